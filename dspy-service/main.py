@@ -5,13 +5,22 @@ Enhanced tutoring service using DSPy framework for systematic AI optimization
 
 import os
 import asyncio
-from typing import List, Dict, Any, Optional
+import hashlib
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from typing import List, Dict, Any, Optional, Protocol
 from contextlib import asynccontextmanager
 
 import dspy
+import httpx
+import orjson
+import litellm
 from fastapi import FastAPI, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, Field, field_validator
 import uvicorn
 from dotenv import load_dotenv
 from loguru import logger
@@ -31,28 +40,47 @@ load_dotenv()
 vector_service: Optional[VectorService] = None
 optimization_service: Optional[OptimizationService] = None
 educational_metrics: Optional[EducationalMetrics] = None
+inference_executor: Optional[ThreadPoolExecutor] = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Initialize and cleanup services"""
-    global vector_service, optimization_service, educational_metrics
+    global vector_service, optimization_service, educational_metrics, inference_executor
+    
+    lm_http_client = None
+    lm_async_http_client = None
     
     try:
         # Initialize DSPy configuration with Google Gemini
         if not os.getenv("GOOGLE_API_KEY"):
             raise ValueError("GOOGLE_API_KEY environment variable is required")
 
-        # Configure Google Generative AI directly
-        import google.generativeai as genai
-        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        # Share pooled keep-alive connections across all LiteLLM calls to Gemini
+        lm_http_limits = httpx.Limits(
+            max_keepalive_connections=int(os.getenv("LM_MAX_KEEPALIVE_CONNECTIONS", "32")),
+            max_connections=int(os.getenv("LM_MAX_CONNECTIONS", "64"))
+        )
+        lm_http_timeout = httpx.Timeout(float(os.getenv("REQUEST_TIMEOUT", "60")), connect=10.0)
+        lm_http_client = httpx.Client(limits=lm_http_limits, timeout=lm_http_timeout)
+        lm_async_http_client = httpx.AsyncClient(limits=lm_http_limits, timeout=lm_http_timeout)
+        litellm.client_session = lm_http_client
+        litellm.aclient_session = lm_async_http_client
 
         lm = dspy.LM(
             model=os.getenv("DEFAULT_LM_MODEL", "gemini/gemini-2.5-flash"),
-            api_key=os.getenv("GOOGLE_API_KEY")
+            api_key=os.getenv("GOOGLE_API_KEY"),
+            # LiteLLM retries rate-limited calls with exponential backoff
+            num_retries=int(os.getenv("LM_NUM_RETRIES", "5"))
         )
         dspy.configure(lm=lm)
 
-        logger.info(f"Initialized DSPy with model: {os.getenv('DEFAULT_LM_MODEL', 'gemini/gemini-2.5-flash')}")
+        # Bounded pool for synchronous DSPy inference so concurrent requests overlap LM latency
+        inference_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("DSPY_WORKERS", "32")),
+            thread_name_prefix="dspy"
+        )
+
+        logger.info("Initialized DSPy with model: {}", lm.model)
         
         # Initialize services
         vector_service = VectorService()
@@ -65,12 +93,18 @@ async def lifespan(app: FastAPI):
         yield
         
     except Exception as e:
-        logger.error(f"Failed to initialize services: {e}")
+        logger.error("Failed to initialize services: {}", e)
         raise
     finally:
         # Cleanup
         if vector_service:
             await vector_service.cleanup()
+        if lm_http_client:
+            lm_http_client.close()
+        if lm_async_http_client:
+            await lm_async_http_client.aclose()
+        if inference_executor:
+            inference_executor.shutdown(wait=False, cancel_futures=True)
         logger.info("DSPy AI Tutor Service shutdown complete")
 
 # FastAPI app
@@ -78,7 +112,8 @@ app = FastAPI(
     title="DSPy AI Tutor Service",
     description="Enhanced AI tutoring service using DSPy framework",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -91,14 +126,27 @@ app.add_middleware(
 )
 
 # Request/Response Models
+class Subject(str, Enum):
+    """Subject areas with a dedicated tutor module"""
+    general = "general"
+    math = "math"
+    programming = "programming"
+    adaptive = "adaptive"
+
 class ChatRequest(BaseModel):
     message: str = Field(..., description="Student's question or message")
     conversation_id: Optional[str] = Field(None, description="Conversation ID for context")
     user_id: Optional[str] = Field("anonymous", description="User ID for personalization")
-    subject: Optional[str] = Field("general", description="Subject area (math, programming, general)")
+    subject: Subject = Field(Subject.general, description="Subject area (math, programming, general)")
     difficulty_level: Optional[str] = Field("intermediate", description="Difficulty level")
     context: Optional[Dict[str, Any]] = Field(default_factory=dict, description="Additional context")
 
+    @field_validator("subject", mode="before")
+    @classmethod
+    def route_unknown_subjects(cls, value):
+        """Send subjects without a dedicated tutor (e.g. science) to the general tutor"""
+        return value if isinstance(value, str) and value in Subject._value2member_map_ else Subject.general
+
 class ChatResponse(BaseModel):
     response: str = Field(..., description="AI tutor's response")
     explanation: Optional[str] = Field(None, description="Detailed explanation")
@@ -120,6 +168,71 @@ tutor_modules = {
     "adaptive": AdaptiveTutor()
 }
 
+# Resolve each module's entry point once instead of introspecting per request
+tutor_forwards = {
+    name: module.forward if hasattr(module, "forward") else module
+    for name, module in tutor_modules.items()
+}
+
+# Output field streamed token by token for each subject, as (predictor name, field name);
+# math streams whole response sections instead, and other subjects only send the final response
+STREAM_FIELDS = {
+    "general": ("respond.predict", "response"),
+    "adaptive": ("unified.predict", "personalized_response"),
+}
+
+def next_section(sections):
+    """Advance a section generator, returning (True, section) or (False, its return value) once exhausted"""
+    try:
+        return True, next(sections)
+    except StopIteration as done:
+        return False, done.value
+
+async def stream_math_sections(**inputs):
+    """Yield MathTutor response sections as the calls they depend on resolve, then the assembled prediction"""
+    sections = tutor_modules["math"].forward_stream(**inputs)
+    response_sections = []
+    while True:
+        more, value = await run_inference(next_section, sections=sections)
+        if not more:
+            break
+        response_sections.append(value)
+        yield value
+    yield dspy.Prediction(response="".join(response_sections), **value)
+
+def tutor_stream(subject: str):
+    """Streaming wrapper for one request, yielding the subject's answer text chunks, then the final prediction"""
+    if subject == "math":
+        return stream_math_sections
+    module = tutor_modules[subject]
+    stream_listeners = []
+    if subject in STREAM_FIELDS:
+        # Listeners keep per-stream state, so each request gets its own
+        predict_name, field_name = STREAM_FIELDS[subject]
+        stream_listeners.append(dspy.streaming.StreamListener(
+            signature_field_name=field_name,
+            predict=dict(module.named_predictors())[predict_name],
+            predict_name=predict_name
+        ))
+    return dspy.streamify(module, stream_listeners=stream_listeners)
+
+class TutorResult(Protocol):
+    """Fields a tutor module's prediction may carry into ChatResponse"""
+    response: str
+    explanation: Optional[str]
+    next_steps: Optional[List[str]]
+    confidence: Optional[float]
+    sources: Optional[List[str]]
+
+# Prediction attributes copied into ChatResponse
+RESPONSE_FIELDS = tuple(TutorResult.__annotations__)
+
+async def run_inference(fn, /, **kwargs):
+    """Run a synchronous DSPy call on the inference pool without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, fn, **kwargs)
+    return await loop.run_in_executor(inference_executor, call)
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -130,96 +243,128 @@ async def health_check():
         "dspy_version": dspy.__version__
     }
 
+async def prepare_tutor_inputs(request: ChatRequest):
+    """Build the tutor call inputs and any memory preamble for a chat request"""
+    # Get conversation context
+    context = await vector_service.get_conversation_context(
+        request.conversation_id,
+        request.user_id
+    ) if request.conversation_id else []
+
+    # Check if memory context is provided from backend
+    memory_context = request.context.get('memory_context', []) if request.context else []
+    is_memory_query = request.context.get('is_memory_query', False) if request.context else False
+
+    logger.opt(lazy=True).debug("Chat request context: {}", lambda: orjson.dumps(request.context, default=str).decode())
+
+    # Extra context keys are passed through; the core inputs below always win
+    inputs = {
+        "user_id": request.user_id,
+        **request.context,
+        "question": request.message,
+        "context": context,
+        "difficulty_level": request.difficulty_level
+    }
+    memory_response = ""
+
+    # If it's a memory query and we have memory context, use it
+    if is_memory_query and memory_context:
+        logger.info("Using memory context for query: {} items", len(memory_context))
+        # Combine memory context with regular context
+        inputs["context"] = memory_context + context
+
+        # Modules get the remembered snippets as a list; the preamble is formatted from the same list
+        memory_items = [item.get('content', '') for item in memory_context[:5]]
+        inputs["memory_context"] = memory_items
+
+        # Create a memory-aware response
+        memory_info = "\n".join([f"Previous context: {content}" for content in memory_items])
+        memory_response = f"Yes, I can recall our previous conversations about this topic. Here's what I remember:\n\n{memory_info}\n\nBased on our previous discussions, "
+    
+    return inputs, memory_response
+
+def build_response_fields(result: TutorResult, memory_response: str) -> Dict[str, Any]:
+    """Read ChatResponse fields off a tutor prediction, prepending any memory preamble"""
+    response_fields = {name: getattr(result, name, None) for name in RESPONSE_FIELDS}
+    if response_fields["response"] is None:
+        response_fields["response"] = str(result)
+    response_fields["response"] = memory_response + response_fields["response"]
+    return response_fields
+
+def store_chat_turn(background_tasks: BackgroundTasks, request: ChatRequest, ai_response: str) -> str:
+    """Schedule the finished turn for storage and return its conversation ID"""
+    conversation_id = request.conversation_id or f"conv_{hashlib.blake2b(request.message.encode(), digest_size=8).hexdigest()}_{request.user_id}"
+    background_tasks.add_task(
+        vector_service.store_conversation,
+        conversation_id=conversation_id,
+        user_message=request.message,
+        ai_response=ai_response,
+        metadata={
+            "user_id": request.user_id,
+            "subject": request.subject.value,
+            "difficulty_level": request.difficulty_level
+        }
+    )
+    return conversation_id
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest, background_tasks: BackgroundTasks):
     """Main chat endpoint for AI tutoring"""
     try:
-        # Select appropriate tutor module
-        module_key = request.subject if request.subject in tutor_modules else "general"
-        tutor_module = tutor_modules[module_key]
+        inputs, memory_response = await prepare_tutor_inputs(request)
         
-        # Get conversation context
-        context = await vector_service.get_conversation_context(
-            request.conversation_id,
-            request.user_id
-        ) if request.conversation_id else []
-
-        # Check if memory context is provided from backend
-        memory_context = request.context.get('memory_context', []) if request.context else []
-        is_memory_query = request.context.get('is_memory_query', False) if request.context else False
-
-        # If it's a memory query and we have memory context, use it
-        if is_memory_query and memory_context:
-            logger.info(f"Using memory context for query: {len(memory_context)} items")
-            # Combine memory context with regular context
-            combined_context = memory_context + context
-
-            # Create a memory-aware response
-            memory_info = "\n".join([f"Previous context: {item.get('content', '')}" for item in memory_context[:5]])
-            memory_response = f"Yes, I can recall our previous conversations about this topic. Here's what I remember:\n\n{memory_info}\n\nBased on our previous discussions, "
-
-            # Generate response using DSPy module with memory context
-            if hasattr(tutor_module, 'forward'):
-                result = tutor_module.forward(
-                    question=request.message,
-                    context=combined_context,
-                    difficulty_level=request.difficulty_level,
-                    memory_context=memory_info,
-                    **request.context
-                )
-            else:
-                result = tutor_module(
-                    question=request.message,
-                    context=combined_context,
-                    difficulty_level=request.difficulty_level
-                )
-
-            # Prepend memory information to the response
-            if hasattr(result, 'response'):
-                result.response = memory_response + result.response
-            else:
-                result = memory_response + str(result)
-        else:
-            # Generate response using DSPy module normally
-            if hasattr(tutor_module, 'forward'):
-                result = tutor_module.forward(
-                    question=request.message,
-                    context=context,
-                    difficulty_level=request.difficulty_level,
-                    **request.context
-                )
-            else:
-                result = tutor_module(
-                    question=request.message,
-                    context=context,
-                    difficulty_level=request.difficulty_level
-                )
+        # Generate response using the subject's DSPy module (off the event loop)
+        result = await run_inference(tutor_forwards[request.subject], **inputs)
         
-        # Store conversation for future context
-        conversation_id = request.conversation_id or f"conv_{hash(request.message)}_{request.user_id}"
-        await vector_service.store_conversation(
-            conversation_id=conversation_id,
-            user_message=request.message,
-            ai_response=result.response if hasattr(result, 'response') else str(result),
-            metadata={
-                "user_id": request.user_id,
-                "subject": request.subject,
-                "difficulty_level": request.difficulty_level
-            }
-        )
+        # Store conversation for future context once the response has been sent
+        response_fields = build_response_fields(result, memory_response)
+        conversation_id = store_chat_turn(background_tasks, request, response_fields["response"])
         
-        return ChatResponse(
-            response=result.response if hasattr(result, 'response') else str(result),
-            explanation=getattr(result, 'explanation', None),
-            next_steps=getattr(result, 'next_steps', None),
-            confidence=getattr(result, 'confidence', None),
-            sources=getattr(result, 'sources', None),
-            conversation_id=conversation_id
-        )
+        return ChatResponse(**response_fields, conversation_id=conversation_id)
         
     except Exception as e:
-        logger.error(f"Chat endpoint error: {e}")
+        logger.error("Chat endpoint error: {}", e)
+        raise HTTPException(status_code=500, detail=f"Failed to process chat request: {str(e)}")
+
+def sse_event(payload: Dict[str, Any]) -> str:
+    """Format a payload as a Server-Sent Events data frame"""
+    return f"data: {orjson.dumps(payload, default=str).decode()}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest, background_tasks: BackgroundTasks):
+    """Chat endpoint streaming the answer field as Server-Sent Events, ending with the full response"""
+    try:
+        inputs, memory_response = await prepare_tutor_inputs(request)
+        stream = tutor_stream(request.subject)
+    except Exception as e:
+        logger.error("Chat stream setup error: {}", e)
         raise HTTPException(status_code=500, detail=f"Failed to process chat request: {str(e)}")
+    
+    async def event_generator():
+        try:
+            if memory_response:
+                yield sse_event({"delta": memory_response})
+            
+            result = None
+            async for chunk in stream(**inputs):
+                # Raw LM chunks carry every sub-call's adapter markup; only listener output is forwarded
+                if isinstance(chunk, dspy.Prediction):
+                    result = chunk
+                elif isinstance(chunk, dspy.streaming.StreamResponse) and chunk.chunk:
+                    yield sse_event({"delta": chunk.chunk})
+                elif isinstance(chunk, str) and chunk:
+                    yield sse_event({"delta": chunk})
+            
+            # The final event carries the post-processed response, stored once generation ends
+            response_fields = build_response_fields(result, memory_response)
+            conversation_id = store_chat_turn(background_tasks, request, response_fields["response"])
+            yield sse_event({"done": True, **response_fields, "conversation_id": conversation_id})
+            
+        except Exception as e:
+            logger.error("Chat stream error: {}", e)
+            yield sse_event({"error": f"Failed to process chat request: {str(e)}"})
+    
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
 
 @app.post("/optimize")
 async def optimize_module(request: OptimizationRequest, background_tasks: BackgroundTasks):
@@ -240,7 +385,7 @@ async def optimize_module(request: OptimizationRequest, background_tasks: Backgr
         return {"message": f"Optimization started for module '{request.module_name}'"}
         
     except Exception as e:
-        logger.error(f"Optimization error: {e}")
+        logger.error("Optimization error: {}", e)
         raise HTTPException(status_code=500, detail=f"Failed to start optimization: {str(e)}")
 
 @app.get("/modules")
@@ -256,6 +401,12 @@ async def list_modules():
         }
     }
 
+@app.delete("/profile/{user_id}")
+async def invalidate_student_profile(user_id: str):
+    """Forget cached adaptive student profiles for a user"""
+    removed = tutor_modules["adaptive"].invalidate_profile(user_id)
+    return {"message": f"Invalidated {removed} cached profile(s) for user '{user_id}'"}
+
 @app.get("/metrics/{conversation_id}")
 async def get_conversation_metrics(conversation_id: str):
     """Get educational effectiveness metrics for a conversation"""
@@ -263,7 +414,7 @@ async def get_conversation_metrics(conversation_id: str):
         metrics = await educational_metrics.calculate_conversation_metrics(conversation_id)
         return metrics
     except Exception as e:
-        logger.error(f"Metrics error: {e}")
+        logger.error("Metrics error: {}", e)
         raise HTTPException(status_code=500, detail=f"Failed to calculate metrics: {str(e)}")
 
 if __name__ == "__main__":
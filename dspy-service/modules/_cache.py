@@ -0,0 +1,147 @@
+"""
+In-process caches shared by the tutor modules
+"""
+
+import os
+import ast
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+import dspy
+from dspy.dsp.utils.settings import main_thread_config
+
+
+class TTLCache:
+    """Thread-safe LRU whose entries expire after a TTL"""
+    
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+    
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def discard_where(self, predicate: Callable[[Any], bool]) -> int:
+        """Remove every entry whose key matches ``predicate``, returning how many were removed"""
+        with self._lock:
+            stale = [key for key in self._entries if predicate(key)]
+            for key in stale:
+                del self._entries[key]
+            return len(stale)
+
+
+
+# Code fields are canonicalized so formatting and comment changes share a cache entry
+_CODE_FIELDS = frozenset({"code", "original_code"})
+
+
+def normalize_code(code: str) -> str:
+    """Canonicalize Python source via the AST, falling back to stripped text for other languages"""
+    try:
+        return ast.unparse(ast.parse(code))
+    except (SyntaxError, ValueError, RecursionError):
+        return code.strip()
+
+
+def _normalize_input(name: str, value: Any) -> str:
+    """Normalize one predictor input for hashing"""
+    text = str(value)
+    if name in _CODE_FIELDS:
+        return normalize_code(text)
+    return " ".join(text.split())
+
+
+def predictor_fingerprint(predictor) -> bytes:
+    """Predictor state (demos, instructions, own LM) plus the active LM, so candidate programs never share entries"""
+    lm = dspy.settings.lm
+    state = {
+        "predictor": predictor.dump_state(),
+        "lm": lm.dump_state() if hasattr(lm, "dump_state") else repr(lm),
+    }
+    return json.dumps(state, sort_keys=True, default=str).encode()
+
+
+def tracing() -> bool:
+    """Whether an optimizer is recording traces, i.e. a dspy.context(trace=[...]) replaced the global trace"""
+    trace = dspy.settings.trace
+    return trace is not None and trace is not main_thread_config.get("trace")
+
+
+_prediction_cache = TTLCache(
+    maxsize=int(os.getenv("TUTOR_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("TUTOR_CACHE_TTL", "3600"))
+)
+
+
+# Calls currently running, so concurrent identical requests share one LM round trip
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+class PredictionCacheMixin:
+    """Exact-match cache in front of a dspy.Module's predictor calls"""
+    
+    def _cached_call(self, predictor_name: str, **inputs):
+        """Call ``self.<predictor_name>(**inputs)``, reusing the prediction for normalized-identical inputs"""
+        predictor = getattr(self, predictor_name)
+        
+        # A cache hit records no trace, so optimizers always reach the predictor
+        if tracing():
+            return predictor(**inputs)
+        
+        digest = hashlib.sha256(predictor_fingerprint(predictor))
+        for name in sorted(inputs):
+            digest.update(name.encode())
+            digest.update(b"\0")
+            digest.update(_normalize_input(name, inputs[name]).encode())
+            digest.update(b"\0")
+        key = (type(self).__name__, predictor_name, digest.hexdigest())
+        
+        prediction = _prediction_cache.get(key)
+        if prediction is not None:
+            return prediction
+        
+        with _inflight_lock:
+            future = _inflight.get(key)
+            leader = future is None
+            if leader:
+                future = _inflight[key] = Future()
+        if not leader:
+            return future.result()
+        
+        # The leader runs the call inline and publishes its outcome to any followers
+        try:
+            prediction = predictor(**inputs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            _prediction_cache.put(key, prediction)
+            future.set_result(prediction)
+            return prediction
+        finally:
+            with _inflight_lock:
+                _inflight.pop(key, None)
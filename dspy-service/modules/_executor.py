@@ -0,0 +1,42 @@
+"""
+Shared worker pool for running independent DSPy sub-calls concurrently
+"""
+
+import os
+import atexit
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import dspy
+from dspy.dsp.utils.settings import thread_local_overrides
+
+
+EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("TUTOR_WORKERS", "8")),
+    thread_name_prefix="tutor"
+)
+atexit.register(EXECUTOR.shutdown, wait=False, cancel_futures=True)
+
+# Overrides that only work on the thread that set them: LM token streams can only be sent
+# from the request's own worker thread
+_THREAD_BOUND_OVERRIDES = frozenset({"send_stream"})
+
+
+def _dspy_overrides() -> dict:
+    """The caller's dspy.context overrides; dspy 2.6 keeps them thread-local, where copy_context misses them"""
+    overrides = getattr(thread_local_overrides, "overrides", None)
+    if not overrides:
+        return {}
+    return {name: value for name, value in overrides.items() if name not in _THREAD_BOUND_OVERRIDES}
+
+
+def _run_with_overrides(overrides: dict, fn, /, *args, **kwargs):
+    if not overrides:
+        return fn(*args, **kwargs)
+    with dspy.context(**overrides):
+        return fn(*args, **kwargs)
+
+
+def submit(fn, /, *args, **kwargs):
+    """Run ``fn`` on the shared pool, carrying over the caller's context and dspy.context overrides"""
+    return EXECUTOR.submit(contextvars.copy_context().run, _run_with_overrides, _dspy_overrides(), fn, *args, **kwargs)
@@ -0,0 +1,40 @@
+"""
+Helpers for reading optional LM output fields off tutor predictions
+"""
+
+import json
+from typing import Any, Iterable, List, Optional
+
+
+def output_field(prediction: Any, name: str) -> Optional[str]:
+    """Return a prediction output as stripped text, or None when the LM left it missing or empty"""
+    value = getattr(prediction, name, None)
+    if value is None:
+        return None
+    text = value.strip() if isinstance(value, str) else str(value)
+    return text or None
+
+
+def output_lines(text: Optional[str]) -> List[str]:
+    """Split an optional multi-line output into lines, empty when missing"""
+    return text.split('\n') if text else []
+
+
+def add_section(parts: List[str], heading: str, body: Optional[str]):
+    """Append a heading, its body and a blank line to response parts when the body is present"""
+    if body:
+        parts.extend([heading, body, ""])
+
+
+def completion_status(*outputs: Optional[str]) -> str:
+    """'complete' when every expected output is present, otherwise 'partial'"""
+    return "complete" if all(outputs) else "partial"
+
+
+def prediction_json(prediction: Any, names: Iterable[str]) -> str:
+    """Compact JSON of selected prediction outputs, for feeding into a later prompt"""
+    return json.dumps(
+        {name: output_field(prediction, name) or "" for name in names},
+        separators=(',', ':'),
+        ensure_ascii=False
+    )
@@ -0,0 +1,27 @@
+"""
+Optional cheaper LM for classification-grade predictor calls
+"""
+
+import os
+import contextlib
+from functools import lru_cache
+from typing import Optional
+
+import dspy
+
+
+@lru_cache(maxsize=1)
+def _classifier_lm() -> Optional[dspy.LM]:
+    """The LM named by CLASSIFIER_LM_MODEL, or None to keep using the configured default"""
+    model = os.getenv("CLASSIFIER_LM_MODEL")
+    if not model:
+        return None
+    return dspy.LM(model=model, api_key=os.getenv("GOOGLE_API_KEY"))
+
+
+def classifier_context():
+    """Context routing the enclosed predictor calls to the classifier LM when one is configured"""
+    lm = _classifier_lm()
+    if lm is None:
+        return contextlib.nullcontext()
+    return dspy.context(lm=lm)
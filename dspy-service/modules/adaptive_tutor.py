@@ -6,7 +6,90 @@ Personalizes learning based on student performance and learning patterns
 import dspy
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
+import os
 import json
+import re
+import hashlib
+from functools import lru_cache
+from loguru import logger
+
+from modules._cache import TTLCache
+from modules._executor import submit
+
+
+# Keywords in student messages that signal each performance category
+_PERFORMANCE_KEYWORDS = {
+    "confusion": ['confused', 'don\'t understand', 'unclear', 'help'],
+    "confidence": ['got it', 'understand', 'clear', 'makes sense'],
+    "engagement": ['interesting', 'cool', 'more', 'another'],
+    "difficulty": ['hard', 'difficult', 'challenging', 'struggle'],
+}
+
+_PERFORMANCE_INDICATORS = {
+    "confusion": "Shows confusion or need for clarification",
+    "confidence": "Shows understanding and confidence",
+    "engagement": "Shows high engagement",
+    "difficulty": "Finds content challenging",
+}
+
+_KEYWORD_SIGNAL = {
+    keyword: signal
+    for signal, keywords in _PERFORMANCE_KEYWORDS.items()
+    for keyword in keywords
+}
+
+_SIGNAL_BIT = {signal: 1 << bit for bit, signal in enumerate(_PERFORMANCE_INDICATORS)}
+_ALL_SIGNALS_MASK = (1 << len(_SIGNAL_BIT)) - 1
+
+# Zero-width lookahead so overlapping keywords (e.g. "understand" inside
+# "don't understand") are all reported, matching plain substring checks
+_PERFORMANCE_KEYWORD_RE = re.compile(
+    "(?=(" + "|".join(re.escape(k) for k in sorted(_KEYWORD_SIGNAL, key=len, reverse=True)) + "))"
+)
+
+_COMPREHENSION_DIFFICULTY = {
+    'beginner': 'easy',
+    'elementary': 'easy',
+    'intermediate': 'moderate',
+    'advanced': 'challenging',
+    'expert': 'challenging'
+}
+
+
+@lru_cache(maxsize=1024)
+def _split_comma_list(text: str) -> tuple:
+    """Split a comma-separated LM field into stripped, non-empty items"""
+    return tuple(item.strip() for item in text.split(',') if item.strip())
+
+# Signatures are parsed once at import and shared by every AdaptiveTutor instance
+_UNIFIED_SIG = dspy.Signature(
+    "question, conversation_history, performance_indicators, current_topic, learning_objectives, current_mood, response_quality -> "
+    "comprehension_level, learning_style, knowledge_gaps, strengths, personalized_path, difficulty_adjustment, "
+    "personalized_response, explanation_style, engagement_techniques, motivation_techniques, progress_indicators"
+)
+_ASSESS_SIG = dspy.Signature(
+    "conversation_history, performance_indicators -> comprehension_level, learning_style, knowledge_gaps, strengths"
+)
+_RECOMMEND_PATH_SIG = dspy.Signature(
+    "student_profile, current_topic, learning_objectives -> personalized_path, difficulty_adjustment, focus_areas"
+)
+_ADAPTIVE_RESPOND_SIG = dspy.Signature(
+    "question, student_profile, context -> personalized_response, explanation_style, engagement_techniques"
+)
+_TRACK_PROGRESS_SIG = dspy.Signature(
+    "previous_assessment, current_interaction, response_quality -> updated_profile, progress_indicators, next_adjustments"
+)
+_ENHANCE_ENGAGEMENT_SIG = dspy.Signature(
+    "student_profile, current_mood, topic_difficulty -> motivation_techniques, encouragement, gamification_elements"
+)
+
+
+# Assessments only change when the recent conversation does, so staged runs reuse
+# the profile and its serialized form
+_profile_cache = TTLCache(
+    maxsize=int(os.getenv("ADAPTIVE_PROFILE_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("ADAPTIVE_PROFILE_CACHE_TTL", "1800"))
+)
 
 
 class StudentProfile(BaseModel):
@@ -25,33 +108,32 @@ class AdaptiveTutor(dspy.Module):
     and learning patterns using DSPy's systematic optimization
     """
     
-    def __init__(self):
+    def __init__(self, fused: Optional[bool] = None):
         super().__init__()
         
+        # Run the whole adaptive pipeline as one LM call unless disabled;
+        # the staged modules stay available for A/B comparison
+        if fused is None:
+            fused = os.getenv("ADAPTIVE_TUTOR_FUSED", "true").lower() == "true"
+        self.fused = fused
+        
+        # Single-call pipeline producing every output of the staged modules below
+        self.unified = dspy.ChainOfThought(_UNIFIED_SIG)
+        
         # Student assessment from conversation history
-        self.assess_student = dspy.ChainOfThought(
-            "conversation_history, performance_indicators -> comprehension_level, learning_style, knowledge_gaps, strengths"
-        )
+        self.assess_student = dspy.ChainOfThought(_ASSESS_SIG)
         
         # Learning path recommendation
-        self.recommend_path = dspy.ChainOfThought(
-            "student_profile, current_topic, learning_objectives -> personalized_path, difficulty_adjustment, focus_areas"
-        )
+        self.recommend_path = dspy.ChainOfThought(_RECOMMEND_PATH_SIG)
         
         # Adaptive response generation
-        self.adaptive_respond = dspy.ChainOfThought(
-            "question, student_profile, context -> personalized_response, explanation_style, engagement_techniques"
-        )
+        self.adaptive_respond = dspy.ChainOfThought(_ADAPTIVE_RESPOND_SIG)
         
         # Progress tracking and adjustment
-        self.track_progress = dspy.Predict(
-            "previous_assessment, current_interaction, response_quality -> updated_profile, progress_indicators, next_adjustments"
-        )
+        self.track_progress = dspy.Predict(_TRACK_PROGRESS_SIG)
         
         # Motivation and engagement enhancement
-        self.enhance_engagement = dspy.ChainOfThought(
-            "student_profile, current_mood, topic_difficulty -> motivation_techniques, encouragement, gamification_elements"
-        )
+        self.enhance_engagement = dspy.ChainOfThought(_ENHANCE_ENGAGEMENT_SIG)
     
     def forward(self, question: str, context: List[Dict] = None, user_id: str = "anonymous", 
                 current_topic: str = "general", **kwargs):
@@ -68,35 +150,11 @@ class AdaptiveTutor(dspy.Module):
         try:
             # Prepare conversation history for analysis
             conversation_history = self._prepare_conversation_history(context)
+            performance_indicators = self._extract_performance_indicators(context)
             
-            # Assess student's current state
-            assessment = self.assess_student(
-                conversation_history=conversation_history,
-                performance_indicators=self._extract_performance_indicators(context)
-            )
-            
-            # Create student profile
-            student_profile = self._create_student_profile(assessment)
-            
-            # Get learning path recommendations
-            learning_path = self.recommend_path(
-                student_profile=str(student_profile),
-                current_topic=current_topic,
-                learning_objectives=kwargs.get('learning_objectives', 'general understanding')
-            )
-            
-            # Generate adaptive response
-            adaptive_response = self.adaptive_respond(
-                question=question,
-                student_profile=str(student_profile),
-                context=conversation_history
-            )
-            
-            # Enhance engagement based on student profile
-            engagement = self.enhance_engagement(
-                student_profile=str(student_profile),
-                current_mood=kwargs.get('mood', 'neutral'),
-                topic_difficulty=getattr(learning_path, 'difficulty_adjustment', 'moderate')
+            pipeline = self._fused_pipeline if self.fused else self._staged_pipeline
+            student_profile, learning_path, adaptive_response, engagement, progress_update = pipeline(
+                question, conversation_history, performance_indicators, current_topic, user_id=user_id, **kwargs
             )
             
             # Construct comprehensive response
@@ -104,13 +162,6 @@ class AdaptiveTutor(dspy.Module):
                 adaptive_response, learning_path, engagement, student_profile
             )
             
-            # Track progress for future interactions
-            progress_update = self.track_progress(
-                previous_assessment=str(student_profile),
-                current_interaction=f"Q: {question} A: {getattr(adaptive_response, 'personalized_response', '')}",
-                response_quality=kwargs.get('response_quality', 'good')
-            )
-            
             return dspy.Prediction(
                 response=response,
                 explanation=getattr(adaptive_response, 'explanation_style', 'Standard explanation'),
@@ -122,25 +173,117 @@ class AdaptiveTutor(dspy.Module):
             )
             
         except Exception as e:
-            print(f"Adaptive tutor error: {e}")
+            logger.error("Adaptive tutor error: {}", e)
             return self._fallback_response(question, context)
     
+    def _fused_pipeline(self, question: str, conversation_history: str, performance_indicators: str,
+                        current_topic: str, **kwargs):
+        """Assess, plan, respond, engage and track progress in a single LM call"""
+        
+        unified = self.unified(
+            question=question,
+            conversation_history=conversation_history,
+            performance_indicators=performance_indicators,
+            current_topic=current_topic,
+            learning_objectives=kwargs.get('learning_objectives', 'general understanding'),
+            current_mood=kwargs.get('mood', 'neutral'),
+            response_quality=kwargs.get('response_quality', 'good')
+        )
+        
+        # The one prediction carries the fields every downstream reader expects
+        student_profile = self._create_student_profile(unified)
+        return student_profile, unified, unified, unified, unified
+    
+    def _staged_pipeline(self, question: str, conversation_history: str, performance_indicators: str,
+                         current_topic: str, user_id: str = "anonymous", **kwargs):
+        """Run assessment, planning, response, engagement and tracking as separate LM calls"""
+        
+        # Reuse the student's profile while their recent conversation is unchanged
+        history_digest = hashlib.blake2b(
+            f"{conversation_history}\n{performance_indicators}".encode(), digest_size=8
+        ).hexdigest()
+        profile_key = (user_id, history_digest)
+        cached = _profile_cache.get(profile_key)
+        
+        if cached is not None:
+            student_profile, profile_str = cached
+        else:
+            # Assess student's current state
+            assessment = self.assess_student(
+                conversation_history=conversation_history,
+                performance_indicators=performance_indicators
+            )
+            
+            # Create student profile
+            student_profile = self._create_student_profile(assessment)
+            
+            # Serialized once and shared by every downstream call
+            profile_str = student_profile.model_dump_json()
+            _profile_cache.put(profile_key, (student_profile, profile_str))
+        
+        # Get learning path recommendations and, concurrently, the adaptive
+        # response; both depend only on the profile
+        learning_path_future = submit(
+            self.recommend_path,
+            student_profile=profile_str,
+            current_topic=current_topic,
+            learning_objectives=kwargs.get('learning_objectives', 'general understanding')
+        )
+        adaptive_response_future = submit(
+            self.adaptive_respond,
+            question=question,
+            student_profile=profile_str,
+            context=conversation_history
+        )
+        learning_path = learning_path_future.result()
+        adaptive_response = adaptive_response_future.result()
+        
+        # Enhance engagement based on student profile, alongside progress
+        # tracking for future interactions
+        engagement_future = submit(
+            self.enhance_engagement,
+            student_profile=profile_str,
+            current_mood=kwargs.get('mood', 'neutral'),
+            topic_difficulty=getattr(learning_path, 'difficulty_adjustment', 'moderate')
+        )
+        progress_update_future = submit(
+            self.track_progress,
+            previous_assessment=profile_str,
+            current_interaction=f"Q: {question} A: {getattr(adaptive_response, 'personalized_response', '')}",
+            response_quality=kwargs.get('response_quality', 'good')
+        )
+        engagement = engagement_future.result()
+        progress_update = progress_update_future.result()
+        
+        return student_profile, learning_path, adaptive_response, engagement, progress_update
+    
+    def invalidate_profile(self, user_id: str) -> int:
+        """Drop cached student profiles for a user, returning how many were removed"""
+        return _profile_cache.discard_where(lambda key: key[0] == user_id)
+    
     def _prepare_conversation_history(self, context: List[Dict]) -> str:
         """Prepare conversation history for analysis"""
         if not context:
             return "No previous conversation history available."
         
-        history_parts = []
-        for item in context[-10:]:  # Last 10 interactions
+        recent = context[-10:]  # Last 10 interactions
+        history_parts = [None] * (3 * len(recent))
+        j = 0
+        for item in recent:
             user_msg = item.get('user_message', item.get('message', ''))
             ai_response = item.get('ai_response', item.get('response', ''))
             
             if user_msg and ai_response:
-                history_parts.append(f"Student: {user_msg}")
-                history_parts.append(f"Tutor: {ai_response[:200]}...")  # Truncate long responses
-                history_parts.append("---")
+                history_parts[j] = f"Student: {user_msg}"
+                history_parts[j + 1] = f"Tutor: {ai_response[:200]}..."  # Truncate long responses
+                history_parts[j + 2] = "---"
+                j += 3
         
-        return '\n'.join(history_parts) if history_parts else "No conversation history available."
+        if not j:
+            return "No conversation history available."
+        if j < len(history_parts):
+            del history_parts[j:]
+        return '\n'.join(history_parts)
     
     def _extract_performance_indicators(self, context: List[Dict]) -> str:
         """Extract performance indicators from conversation context"""
@@ -153,21 +296,16 @@ class AdaptiveTutor(dspy.Module):
         for item in context[-5:]:  # Last 5 interactions
             user_msg = item.get('user_message', '').lower()
             
-            # Look for confusion indicators
-            if any(word in user_msg for word in ['confused', 'don\'t understand', 'unclear', 'help']):
-                indicators.append("Shows confusion or need for clarification")
-            
-            # Look for confidence indicators
-            if any(word in user_msg for word in ['got it', 'understand', 'clear', 'makes sense']):
-                indicators.append("Shows understanding and confidence")
-            
-            # Look for engagement indicators
-            if any(word in user_msg for word in ['interesting', 'cool', 'more', 'another']):
-                indicators.append("Shows high engagement")
-            
-            # Look for difficulty indicators
-            if any(word in user_msg for word in ['hard', 'difficult', 'challenging', 'struggle']):
-                indicators.append("Finds content challenging")
+            # One scan tags every signal category present in the message,
+            # stopping as soon as all of them have been seen
+            mask = 0
+            for match in _PERFORMANCE_KEYWORD_RE.finditer(user_msg):
+                mask |= _SIGNAL_BIT[_KEYWORD_SIGNAL[match.group(1)]]
+                if mask == _ALL_SIGNALS_MASK:
+                    break
+            indicators.extend(
+                indicator for signal, indicator in _PERFORMANCE_INDICATORS.items() if mask & _SIGNAL_BIT[signal]
+            )
         
         return '; '.join(indicators) if indicators else "Neutral performance indicators"
     
@@ -180,8 +318,8 @@ class AdaptiveTutor(dspy.Module):
         strengths = getattr(assessment, 'strengths', 'general problem solving')
         
         # Parse knowledge gaps and strengths into lists
-        gaps_list = [gap.strip() for gap in knowledge_gaps.split(',') if gap.strip()]
-        strengths_list = [strength.strip() for strength in strengths.split(',') if strength.strip()]
+        gaps_list = list(_split_comma_list(knowledge_gaps))
+        strengths_list = list(_split_comma_list(strengths))
         
         return StudentProfile(
             comprehension_level=comprehension_level,
@@ -194,14 +332,7 @@ class AdaptiveTutor(dspy.Module):
     
     def _map_comprehension_to_difficulty(self, comprehension_level: str) -> str:
         """Map comprehension level to preferred difficulty"""
-        mapping = {
-            'beginner': 'easy',
-            'elementary': 'easy',
-            'intermediate': 'moderate',
-            'advanced': 'challenging',
-            'expert': 'challenging'
-        }
-        return mapping.get(comprehension_level.lower(), 'moderate')
+        return _COMPREHENSION_DIFFICULTY.get(comprehension_level.lower(), 'moderate')
     
     def _construct_adaptive_response(self, adaptive_response, learning_path, engagement, student_profile):
         """Construct comprehensive adaptive response"""
@@ -4,10 +4,219 @@ Handles code review, debugging, and programming education
 """
 
 import dspy
+import os
 import re
 import ast
+import json
+import builtins
+from functools import lru_cache
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
+from loguru import logger
+
+from modules._cache import PredictionCacheMixin
+from modules._executor import submit
+from modules._lm import classifier_context
+from modules._fields import output_field, output_lines, add_section, completion_status, prediction_json
+
+
+# Programming concepts recognized in questions, in reporting order
+_CONCEPT_KEYWORDS = (
+    'function', 'variable', 'loop', 'array', 'object', 'class', 'method',
+    'recursion', 'algorithm', 'data structure', 'inheritance', 'polymorphism',
+    'exception', 'async', 'promise', 'callback', 'closure', 'scope'
+)
+
+# Zero-width lookahead so keywords nested in others are all reported, matching
+# plain substring checks
+_CONCEPT_RE = re.compile(
+    "(?=(" + "|".join(re.escape(k) for k in sorted(_CONCEPT_KEYWORDS, key=len, reverse=True)) + "))"
+)
+
+# Question triggers for each kind of assistance; anchored at word starts so
+# inflections like "errors" or "debugging" still match
+_DEBUG_TRIGGER_RE = re.compile(r"\b(?:error|debug|exception|traceback)", re.IGNORECASE)
+_REVIEW_TRIGGER_RE = re.compile(r"\b(?:review|improve|better|refactor|optimi[sz]e)", re.IGNORECASE)
+_EXPLAIN_TRIGGER_RE = re.compile(r"\b(?:explain|what is|how does|difference between)", re.IGNORECASE)
+
+
+# Signatures are parsed once at import and shared by every CodeTutor instance
+_ANALYZE_CODE_SIG = dspy.Signature(
+    "code, language, static_analysis, context -> code_quality, complexity_level, main_concepts, potential_issues"
+)
+_REVIEW_CODE_SIG = dspy.Signature(
+    "code, analysis, requirements -> detailed_review, improvement_suggestions, best_practices"
+)
+_IMPROVE_CODE_SIG = dspy.Signature(
+    "original_code, issues, suggestions -> improved_code, explanation_of_changes, learning_points"
+)
+_EXPLAIN_CONCEPTS_SIG = dspy.Signature(
+    "code_concepts, student_level, programming_language -> concept_explanation, examples, practice_exercises"
+)
+_DEBUG_CODE_SIG = dspy.Signature(
+    "code, error_message, expected_behavior -> debugging_steps, root_cause, solution"
+)
+_FULL_REVIEW_SIG = dspy.Signature(
+    "code, language, static_analysis, context, requirements -> code_quality, complexity_level, main_concepts, potential_issues, "
+    "detailed_review, improvement_suggestions, best_practices, improved_code, explanation_of_changes, learning_points"
+)
+
+# analyze_code outputs passed on to the review step
+_ANALYSIS_FIELDS = ('code_quality', 'complexity_level', 'main_concepts', 'potential_issues')
+
+# Longer code is reviewed in stages so no single completion has to carry every output
+_FUSED_REVIEW_MAX_CHARS = int(os.getenv("CODE_REVIEW_FUSED_MAX_CHARS", "20000"))
+
+# analyze_code only extracts coarse features, so it sees the ends of long code
+_SUMMARY_HEAD_LINES = 40
+_SUMMARY_TAIL_LINES = 20
+
+
+def _summarize_code(code: str, head: int = _SUMMARY_HEAD_LINES, tail: int = _SUMMARY_TAIL_LINES) -> str:
+    """First ``head`` and last ``tail`` lines of code, with a marker where lines were dropped"""
+    lines = code.splitlines()
+    if len(lines) <= head + tail:
+        return code
+    return "\n".join(lines[:head] + ["...<truncated>..."] + lines[-tail:])
+
+
+# Builtin names that user code should not rebind
+_BUILTIN_NAMES = frozenset(dir(builtins))
+
+# Statements that open a nested block for depth measurement
+_BLOCK_NODES = (
+    ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.If, ast.For, ast.AsyncFor,
+    ast.While, ast.With, ast.AsyncWith, ast.Try
+)
+
+
+class _StructureVisitor(ast.NodeVisitor):
+    """Collects structural facts about Python code in one AST walk"""
+    
+    def __init__(self):
+        self.functions = 0
+        self.classes = 0
+        self.bare_excepts = 0
+        self.mutable_defaults = []
+        self.shadowed_builtins = set()
+        self.max_depth = 0
+        self._depth = 0
+    
+    def generic_visit(self, node):
+        if isinstance(node, _BLOCK_NODES):
+            self._depth += 1
+            self.max_depth = max(self.max_depth, self._depth)
+            super().generic_visit(node)
+            self._depth -= 1
+        else:
+            super().generic_visit(node)
+    
+    def visit_FunctionDef(self, node):
+        self.functions += 1
+        self._check_function(node)
+        self.generic_visit(node)
+    
+    def visit_AsyncFunctionDef(self, node):
+        self.functions += 1
+        self._check_function(node)
+        self.generic_visit(node)
+    
+    def visit_ClassDef(self, node):
+        self.classes += 1
+        self._check_name(node.name)
+        self.generic_visit(node)
+    
+    def visit_ExceptHandler(self, node):
+        if node.type is None:
+            self.bare_excepts += 1
+        self.generic_visit(node)
+    
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Store):
+            self._check_name(node.id)
+    
+    def _check_function(self, node):
+        self._check_name(node.name)
+        arguments = node.args
+        for arg in arguments.posonlyargs + arguments.args + arguments.kwonlyargs:
+            self._check_name(arg.arg)
+        for default in arguments.defaults + [d for d in arguments.kw_defaults if d is not None]:
+            if isinstance(default, (ast.List, ast.Dict, ast.Set)) or (
+                isinstance(default, ast.Call) and isinstance(default.func, ast.Name)
+                and default.func.id in ('list', 'dict', 'set')
+            ):
+                self.mutable_defaults.append(node.name)
+                break
+    
+    def _check_name(self, name: str):
+        if name in _BUILTIN_NAMES:
+            self.shadowed_builtins.add(name)
+
+
+@lru_cache(maxsize=512)
+def _static_analyze_python(code: str) -> str:
+    """Deterministic structural summary of Python code, as JSON for the analysis prompt"""
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError) as e:
+        return json.dumps({"syntax_error": f"{getattr(e, 'msg', e)} (line {getattr(e, 'lineno', '?')})"})
+    
+    visitor = _StructureVisitor()
+    visitor.visit(tree)
+    return json.dumps({
+        "num_functions": visitor.functions,
+        "num_classes": visitor.classes,
+        "max_nesting_depth": visitor.max_depth,
+        "bare_excepts": visitor.bare_excepts,
+        "mutable_default_args": visitor.mutable_defaults,
+        "shadowed_builtins": sorted(visitor.shadowed_builtins)
+    })
+
+
+def _static_analysis(code: str, language: str) -> str:
+    """Static analysis input for the code analysis prompts"""
+    if code and language.lower() == 'python':
+        return _static_analyze_python(code)
+    return "not available"
+
+
+@lru_cache(maxsize=4096)
+def _classify_assistance(question: str, has_code: bool, has_error: bool) -> str:
+    """Kind of programming assistance a question asks for"""
+    if has_error or _DEBUG_TRIGGER_RE.search(question):
+        return "debugging"
+    elif has_code and _REVIEW_TRIGGER_RE.search(question):
+        return "code_review"
+    elif not has_code and _EXPLAIN_TRIGGER_RE.search(question):
+        return "concept_explanation"
+    else:
+        return "general_programming"
+
+
+@lru_cache(maxsize=2048)
+def _extract_concepts_from(question: str) -> str:
+    """Comma-separated concepts mentioned in a question, in keyword order"""
+    found = {match.group(1) for match in _CONCEPT_RE.finditer(question.lower())}
+    concepts = [keyword for keyword in _CONCEPT_KEYWORDS if keyword in found]
+    return ', '.join(concepts) if concepts else 'general programming'
+
+
+# Static parts of the fallback reply when the LM pipeline fails
+_FALLBACK_GUIDANCE = (
+    "I'm here to help with programming questions, code review, debugging, and concept explanations.\n\n"
+    "To provide the best assistance, please let me know:\n"
+    "- What programming language you're using\n"
+    "- What specific problem you're trying to solve\n"
+    "- Any error messages you're encountering\n"
+    "- Your current skill level\n\n"
+)
+_FALLBACK_CODE_NOTE = "I can see you've provided some code. Let me analyze it for you."
+_FALLBACK_NEXT_STEPS = (
+    "Provide more specific details about your programming question",
+    "Share the code you're working with",
+    "Specify the programming language",
+    "Describe what you're trying to achieve"
+)
 
 
 class CodeAnalysis(BaseModel):
@@ -20,7 +229,7 @@ class CodeAnalysis(BaseModel):
     learning_resources: List[str]
 
 
-class CodeTutor(dspy.Module):
+class CodeTutor(PredictionCacheMixin, dspy.Module):
     """
     Specialized DSPy module for programming tutoring and code review
     Uses ReAct approach for systematic code analysis and improvement
@@ -29,30 +238,26 @@ class CodeTutor(dspy.Module):
     def __init__(self):
         super().__init__()
         
+        # Each signature leads with its long code input so repeated calls on the same
+        # code share a cacheable prompt prefix; keep it first when editing fields
+        
         # Code analysis and classification
-        self.analyze_code = dspy.ChainOfThought(
-            "code, language, context -> code_quality, complexity_level, main_concepts, potential_issues"
-        )
+        self.analyze_code = dspy.ChainOfThought(_ANALYZE_CODE_SIG)
         
         # Code review and improvement suggestions
-        self.review_code = dspy.ChainOfThought(
-            "code, analysis, requirements -> detailed_review, improvement_suggestions, best_practices"
-        )
+        self.review_code = dspy.ChainOfThought(_REVIEW_CODE_SIG)
         
         # Code improvement generation
-        self.improve_code = dspy.ChainOfThought(
-            "original_code, issues, suggestions -> improved_code, explanation_of_changes, learning_points"
-        )
+        self.improve_code = dspy.ChainOfThought(_IMPROVE_CODE_SIG)
         
         # Programming concept explanation
-        self.explain_concepts = dspy.ChainOfThought(
-            "code_concepts, student_level, programming_language -> concept_explanation, examples, practice_exercises"
-        )
+        self.explain_concepts = dspy.ChainOfThought(_EXPLAIN_CONCEPTS_SIG)
         
         # Debugging assistance
-        self.debug_code = dspy.ChainOfThought(
-            "code, error_message, expected_behavior -> debugging_steps, root_cause, solution"
-        )
+        self.debug_code = dspy.ChainOfThought(_DEBUG_CODE_SIG)
+        
+        # Analysis, review and improvement in a single LM call
+        self.full_review = dspy.ChainOfThought(_FULL_REVIEW_SIG)
     
     def forward(self, question: str, code: str = "", language: str = "python", 
                 context: str = "", error_message: str = "", **kwargs):
@@ -81,123 +286,100 @@ class CodeTutor(dspy.Module):
                 return self._handle_general_programming(question, code, language, context)
                 
         except Exception as e:
-            print(f"Code tutor error: {e}")
+            logger.error("Code tutor error: {}", e)
             return self._fallback_response(question, code)
     
     def _determine_assistance_type(self, question: str, code: str, error_message: str) -> str:
         """Determine what type of programming assistance is needed"""
-        question_lower = question.lower()
-        
-        if error_message or "error" in question_lower or "debug" in question_lower:
-            return "debugging"
-        elif code and ("review" in question_lower or "improve" in question_lower or "better" in question_lower):
-            return "code_review"
-        elif not code and ("explain" in question_lower or "what is" in question_lower or "how does" in question_lower):
-            return "concept_explanation"
-        else:
-            return "general_programming"
+        return _classify_assistance(question, bool(code), bool(error_message))
     
     def _handle_debugging(self, question: str, code: str, error_message: str, language: str):
         """Handle debugging assistance"""
         
-        # Analyze the code first
-        analysis = self.analyze_code(
-            code=code,
-            language=language,
-            context=f"Debugging: {error_message}"
-        )
-        
-        # Debug the specific issue
-        debug_result = self.debug_code(
+        # Analyze the code while debugging the specific issue; neither needs the other
+        with classifier_context():
+            analysis_future = submit(
+                self._cached_call,
+                "analyze_code",
+                code=_summarize_code(code),
+                language=language,
+                static_analysis=_static_analysis(code, language),
+                context=f"Debugging: {error_message}"
+            )
+        debug_result = self._cached_call(
+            "debug_code",
             code=code,
             error_message=error_message,
             expected_behavior=question
         )
+        analysis = analysis_future.result()
         
-        debugging_steps = getattr(debug_result, 'debugging_steps', 'No debugging steps generated')
-        root_cause = getattr(debug_result, 'root_cause', 'Unable to determine root cause')
-        solution = getattr(debug_result, 'solution', 'No solution provided')
+        debugging_steps = output_field(debug_result, 'debugging_steps')
+        root_cause = output_field(debug_result, 'root_cause')
+        solution = output_field(debug_result, 'solution')
+        complexity_level = output_field(analysis, 'complexity_level')
+        main_concepts = output_field(analysis, 'main_concepts')
         
-        response = f"""**Debugging Analysis**
-
-**Error:** {error_message}
-
-**Root Cause:**
-{root_cause}
-
-**Debugging Steps:**
-{debugging_steps}
-
-**Solution:**
-{solution}
-
-**Code Quality Assessment:**
-- Complexity: {getattr(analysis, 'complexity_level', 'Unknown')}
-- Main Concepts: {getattr(analysis, 'main_concepts', 'Not analyzed')}
-"""
+        # Sections the LM left empty are omitted rather than filled with placeholders
+        response_parts = [
+            "**Debugging Analysis**",
+            "",
+            f"**Error:** {error_message}",
+            ""
+        ]
+        add_section(response_parts, "**Root Cause:**", root_cause)
+        add_section(response_parts, "**Debugging Steps:**", debugging_steps)
+        add_section(response_parts, "**Solution:**", solution)
+        assessment = []
+        if complexity_level:
+            assessment.append(f"- Complexity: {complexity_level}")
+        if main_concepts:
+            assessment.append(f"- Main Concepts: {main_concepts}")
+        add_section(response_parts, "**Code Quality Assessment:**", '\n'.join(assessment))
+        response = '\n'.join(response_parts)
         
         return dspy.Prediction(
             response=response,
-            explanation=f"The error occurs because: {root_cause}",
+            explanation=f"The error occurs because: {root_cause}" if root_cause else None,
             next_steps=[
                 "Apply the suggested solution",
                 "Test the fixed code",
                 "Review similar error patterns",
                 "Practice defensive programming"
             ],
-            debugging_steps=debugging_steps.split('\n') if isinstance(debugging_steps, str) else [debugging_steps],
+            debugging_steps=output_lines(debugging_steps),
             root_cause=root_cause,
-            solution=solution
+            solution=solution,
+            status=completion_status(root_cause, debugging_steps, solution)
         )
     
     def _handle_code_review(self, question: str, code: str, language: str, context: str):
         """Handle code review and improvement"""
         
-        # Analyze the code
-        analysis = self.analyze_code(
-            code=code,
-            language=language,
-            context=context
-        )
-        
-        # Perform detailed review
-        review = self.review_code(
-            code=code,
-            analysis=str(analysis),
-            requirements=question
-        )
+        # Review in one LM call when the code is small enough, falling back to the staged chain
+        stages = None
+        if len(code) <= _FUSED_REVIEW_MAX_CHARS:
+            stages = self._fused_review(question, code, language, context)
+        if stages is None:
+            stages = self._staged_review(question, code, language, context)
+        analysis, review, improvement = stages
         
-        # Generate improved code
-        improvement = self.improve_code(
-            original_code=code,
-            issues=getattr(analysis, 'potential_issues', 'No issues identified'),
-            suggestions=getattr(review, 'improvement_suggestions', 'No suggestions')
-        )
+        code_quality = output_field(analysis, 'code_quality')
+        detailed_review = output_field(review, 'detailed_review')
+        improvement_suggestions = output_field(review, 'improvement_suggestions')
+        improved_code = output_field(improvement, 'improved_code')
+        explanation_of_changes = output_field(improvement, 'explanation_of_changes')
         
-        code_quality = getattr(analysis, 'code_quality', 'Good')
-        detailed_review = getattr(review, 'detailed_review', 'No detailed review available')
-        improvement_suggestions = getattr(review, 'improvement_suggestions', 'No suggestions')
-        improved_code = getattr(improvement, 'improved_code', 'No improved version generated')
-        explanation_of_changes = getattr(improvement, 'explanation_of_changes', 'No explanation available')
-        
-        response = f"""**Code Review Results**
-
-**Overall Quality:** {code_quality}
-
-**Detailed Analysis:**
-{detailed_review}
-
-**Improvement Suggestions:**
-{improvement_suggestions}
-
-**Improved Code:**
-```{language}
-{improved_code}
-```
-
-**Explanation of Changes:**
-{explanation_of_changes}
-"""
+        # Sections the LM left empty are omitted rather than filled with placeholders
+        response_parts = ["**Code Review Results**", ""]
+        if code_quality:
+            response_parts.extend([f"**Overall Quality:** {code_quality}", ""])
+        add_section(response_parts, "**Detailed Analysis:**", detailed_review)
+        add_section(response_parts, "**Improvement Suggestions:**", improvement_suggestions)
+        if improved_code:
+            add_section(response_parts, "**Improved Code:**", f"```{language}\n{improved_code}\n```")
+        add_section(response_parts, "**Explanation of Changes:**", explanation_of_changes)
+        response = '\n'.join(response_parts)
         
         return dspy.Prediction(
             response=response,
@@ -210,9 +392,63 @@ class CodeTutor(dspy.Module):
             ],
             code_quality=code_quality,
             improved_code=improved_code,
-            suggestions=improvement_suggestions.split('\n') if isinstance(improvement_suggestions, str) else [improvement_suggestions]
+            suggestions=output_lines(improvement_suggestions),
+            status=completion_status(code_quality, detailed_review, improvement_suggestions, improved_code, explanation_of_changes)
         )
     
+    def _fused_review(self, question: str, code: str, language: str, context: str):
+        """Analyze, review and improve code in one LM call, or None if the output is unusable"""
+        try:
+            review = self._cached_call(
+                "full_review",
+                code=code,
+                language=language,
+                static_analysis=_static_analysis(code, language),
+                context=context,
+                requirements=question
+            )
+        except Exception as e:
+            logger.error("Fused code review error: {}", e)
+            return None
+        
+        # A malformed completion falls back to the staged chain
+        if not (output_field(review, 'detailed_review') and output_field(review, 'improved_code')):
+            return None
+        
+        # The one prediction carries the fields every downstream reader expects
+        return review, review, review
+    
+    def _staged_review(self, question: str, code: str, language: str, context: str):
+        """Analyze, review and improve code as three chained LM calls"""
+        
+        # Analyze the code
+        with classifier_context():
+            analysis = self._cached_call(
+                "analyze_code",
+                code=_summarize_code(code),
+                language=language,
+                static_analysis=_static_analysis(code, language),
+                context=context
+            )
+        
+        # Perform detailed review
+        review = self._cached_call(
+            "review_code",
+            code=code,
+            analysis=prediction_json(analysis, _ANALYSIS_FIELDS),
+            requirements=question
+        )
+        
+        # Generate improved code
+        improvement = self._cached_call(
+            "improve_code",
+            original_code=code,
+            issues=getattr(analysis, 'potential_issues', 'No issues identified'),
+            suggestions=getattr(review, 'improvement_suggestions', 'No suggestions')
+        )
+        
+        return analysis, review, improvement
+    
     def _handle_concept_explanation(self, question: str, language: str, student_level: str):
         """Handle programming concept explanations"""
         
@@ -220,29 +456,28 @@ class CodeTutor(dspy.Module):
         concepts = self._extract_concepts(question)
         
         # Explain the concepts
-        explanation = self.explain_concepts(
+        explanation = self._cached_call(
+            "explain_concepts",
             code_concepts=concepts,
             student_level=student_level,
             programming_language=language
         )
         
-        concept_explanation = getattr(explanation, 'concept_explanation', 'No explanation available')
-        examples = getattr(explanation, 'examples', 'No examples provided')
-        practice_exercises = getattr(explanation, 'practice_exercises', 'No exercises provided')
+        concept_explanation = output_field(explanation, 'concept_explanation')
+        examples = output_field(explanation, 'examples')
+        practice_exercises = output_field(explanation, 'practice_exercises')
         
-        response = f"""**Programming Concept Explanation**
-
-**Topic:** {concepts}
-
-**Explanation:**
-{concept_explanation}
-
-**Examples:**
-{examples}
-
-**Practice Exercises:**
-{practice_exercises}
-"""
+        # Sections the LM left empty are omitted rather than filled with placeholders
+        response_parts = [
+            "**Programming Concept Explanation**",
+            "",
+            f"**Topic:** {concepts}",
+            ""
+        ]
+        add_section(response_parts, "**Explanation:**", concept_explanation)
+        add_section(response_parts, "**Examples:**", examples)
+        add_section(response_parts, "**Practice Exercises:**", practice_exercises)
+        response = '\n'.join(response_parts)
         
         return dspy.Prediction(
             response=response,
@@ -255,7 +490,8 @@ class CodeTutor(dspy.Module):
             ],
             concepts=concepts,
             examples=examples,
-            practice_exercises=practice_exercises.split('\n') if isinstance(practice_exercises, str) else [practice_exercises]
+            practice_exercises=output_lines(practice_exercises),
+            status=completion_status(concept_explanation, examples, practice_exercises)
         )
     
     def _handle_general_programming(self, question: str, code: str, language: str, context: str):
@@ -263,11 +499,14 @@ class CodeTutor(dspy.Module):
         
         if code:
             # Analyze provided code
-            analysis = self.analyze_code(
-                code=code,
-                language=language,
-                context=context
-            )
+            with classifier_context():
+                analysis = self._cached_call(
+                    "analyze_code",
+                    code=_summarize_code(code),
+                    language=language,
+                    static_analysis=_static_analysis(code, language),
+                    context=context
+                )
             
             response = f"""**Programming Assistance**
 
@@ -320,36 +559,14 @@ Would you like me to provide specific examples or code snippets to illustrate th
     def _extract_concepts(self, question: str) -> str:
         """Extract programming concepts from the question"""
         # Simple keyword extraction - could be enhanced with NLP
-        concepts = []
-        keywords = [
-            'function', 'variable', 'loop', 'array', 'object', 'class', 'method',
-            'recursion', 'algorithm', 'data structure', 'inheritance', 'polymorphism',
-            'exception', 'async', 'promise', 'callback', 'closure', 'scope'
-        ]
-        
-        question_lower = question.lower()
-        for keyword in keywords:
-            if keyword in question_lower:
-                concepts.append(keyword)
-        
-        return ', '.join(concepts) if concepts else 'general programming'
+        return _extract_concepts_from(question)
     
     def _fallback_response(self, question: str, code: str = ""):
         """Fallback response when main processing fails"""
         return dspy.Prediction(
-            response=f"I understand you're asking about: {question}\n\n"
-                    "I'm here to help with programming questions, code review, debugging, and concept explanations.\n\n"
-                    "To provide the best assistance, please let me know:\n"
-                    "- What programming language you're using\n"
-                    "- What specific problem you're trying to solve\n"
-                    "- Any error messages you're encountering\n"
-                    "- Your current skill level\n\n"
-                    + (f"I can see you've provided some code. Let me analyze it for you." if code else ""),
+            response=f"I understand you're asking about: {question}\n\n{_FALLBACK_GUIDANCE}"
+                    + (_FALLBACK_CODE_NOTE if code else ""),
             explanation="This is a general programming assistance response.",
-            next_steps=[
-                "Provide more specific details about your programming question",
-                "Share the code you're working with",
-                "Specify the programming language",
-                "Describe what you're trying to achieve"
-            ]
+            next_steps=list(_FALLBACK_NEXT_STEPS),
+            status="fallback"
         )
@@ -6,8 +6,61 @@ Handles mathematical problem solving with step-by-step explanations and verifica
 import dspy
 import re
 import ast
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Generator
 from pydantic import BaseModel
+from loguru import logger
+
+from modules._cache import PredictionCacheMixin
+from modules._executor import submit
+from modules._lm import classifier_context
+from modules._fields import output_field, completion_status
+
+
+# Leading "1." / "Step 1:" style numbering on solution steps and practice problems
+_STEP_NUMBERING_RE = re.compile(r'\d+\.?\s*|Step\s*\d+:?\s*')
+_PROBLEM_NUMBERING_RE = re.compile(r'\d+\.?\s*')
+
+# Classification only needs the gist of the problem statement
+_CLASSIFY_MAX_CHARS = 400
+
+
+# Signatures are parsed once at import and shared by every MathTutor instance
+_CLASSIFY_PROBLEM_SIG = dspy.Signature(
+    "problem -> problem_type, difficulty_level, required_concepts"
+)
+_SOLVE_STEP_BY_STEP_SIG = dspy.Signature(
+    "problem, problem_type -> solution_steps, final_answer"
+)
+_VERIFY_SOLUTION_SIG = dspy.Signature(
+    "problem, solution_steps, verification_code -> is_correct, explanation, corrections"
+)
+_GENERATE_PRACTICE_SIG = dspy.Signature(
+    "solved_problem, difficulty_level, concepts -> similar_problems, progressive_difficulty"
+)
+_ADAPT_EXPLANATION_SIG = dspy.Signature(
+    "solution_steps, student_level -> simplified_explanation, visual_aids_suggestions, mnemonics"
+)
+_CLASSIFY_ADVANCED_SIG = dspy.Signature(
+    "problem -> math_field, complexity_level, prerequisites, solution_approach"
+)
+_EXPLAIN_ADVANCED_CONCEPTS_SIG = dspy.Signature(
+    "math_field, concepts, student_background -> conceptual_explanation, intuitive_understanding, applications"
+)
+
+# Static parts of the fallback reply when the LM pipeline fails
+_FALLBACK_GUIDANCE = (
+    "Let me help you approach this step by step:\n"
+    "1. First, let's identify what type of problem this is\n"
+    "2. Then we'll break it down into manageable steps\n"
+    "3. Finally, we'll solve it together\n\n"
+    "Could you provide any additional context or specify what part you're struggling with?"
+)
+_FALLBACK_NEXT_STEPS = (
+    "Identify the problem type",
+    "Break down into steps",
+    "Apply relevant mathematical concepts"
+)
+_FALLBACK_SOLUTION_STEPS = ("Analyze the problem", "Apply mathematical principles", "Verify the solution")
 
 
 class MathSolution(BaseModel):
@@ -20,7 +73,7 @@ class MathSolution(BaseModel):
     practice_problems: Optional[List[str]] = None
 
 
-class MathTutor(dspy.Module):
+class MathTutor(PredictionCacheMixin, dspy.Module):
     """
     Specialized DSPy module for mathematical problem solving and tutoring
     Uses Program of Thought approach for verifiable solutions
@@ -29,32 +82,26 @@ class MathTutor(dspy.Module):
     def __init__(self):
         super().__init__()
         
+        # Each signature leads with its long problem input so repeated calls on the same
+        # problem share a cacheable prompt prefix; keep it first when editing fields
+        
         # Problem classification
-        self.classify_problem = dspy.Predict(
-            "problem -> problem_type, difficulty_level, required_concepts"
-        )
+        self.classify_problem = dspy.Predict(_CLASSIFY_PROBLEM_SIG)
         
         # Step-by-step solution generation (simplified)
-        self.solve_step_by_step = dspy.ChainOfThought(
-            "problem, problem_type -> solution_steps, final_answer"
-        )
+        self.solve_step_by_step = dspy.ChainOfThought(_SOLVE_STEP_BY_STEP_SIG)
         
         # Solution verification
-        self.verify_solution = dspy.Predict(
-            "problem, solution_steps, verification_code -> is_correct, explanation, corrections"
-        )
+        self.verify_solution = dspy.Predict(_VERIFY_SOLUTION_SIG)
         
         # Practice problem generation
-        self.generate_practice = dspy.ChainOfThought(
-            "solved_problem, difficulty_level, concepts -> similar_problems, progressive_difficulty"
-        )
+        self.generate_practice = dspy.ChainOfThought(_GENERATE_PRACTICE_SIG)
         
         # Explanation enhancement for different learning levels
-        self.adapt_explanation = dspy.ChainOfThought(
-            "solution_steps, student_level -> simplified_explanation, visual_aids_suggestions, mnemonics"
-        )
+        self.adapt_explanation = dspy.ChainOfThought(_ADAPT_EXPLANATION_SIG)
     
-    def forward(self, question: str, difficulty_level: str = "intermediate", student_level: str = "intermediate", **kwargs):
+    def forward(self, question: str, difficulty_level: str = "intermediate", student_level: str = "intermediate",
+                _preclassified: Optional[Tuple[str, str, str]] = None, **kwargs):
         """
         Solve mathematical problems with step-by-step explanations
         
@@ -62,125 +109,175 @@ class MathTutor(dspy.Module):
             question: Mathematical problem or question
             difficulty_level: Problem difficulty (beginner, intermediate, advanced)
             student_level: Student's mathematical level
+            _preclassified: (problem_type, difficulty, concepts) from a caller that already classified the problem
         """
         
         try:
+            stream = self.forward_stream(question, difficulty_level, student_level, _preclassified, **kwargs)
+            response_sections = []
+            while True:
+                try:
+                    response_sections.append(next(stream))
+                except StopIteration as done:
+                    details = done.value
+                    break
+            
+            return dspy.Prediction(response=''.join(response_sections), **details)
+            
+        except Exception as e:
+            logger.error("Math tutor error: {}", e)
+            return self._fallback_response(question)
+    
+    def forward_stream(self, question: str, difficulty_level: str = "intermediate", student_level: str = "intermediate",
+                       _preclassified: Optional[Tuple[str, str, str]] = None, **kwargs) -> Generator[str, None, Dict[str, Any]]:
+        """
+        Yield response sections as soon as the calls they depend on resolve
+        
+        Sections arrive in their final order; the generator returns the structured
+        solution fields (everything but ``response``) once the last one is done.
+        """
+        
+        if _preclassified is not None:
+            problem_type, assessed_difficulty, required_concepts = _preclassified
+        else:
             # Classify the mathematical problem
-            classification = self.classify_problem(problem=question)
+            with classifier_context():
+                classification = self._cached_call("classify_problem", problem=question[:_CLASSIFY_MAX_CHARS])
             
             problem_type = getattr(classification, 'problem_type', 'general')
             assessed_difficulty = getattr(classification, 'difficulty_level', difficulty_level)
             required_concepts = getattr(classification, 'required_concepts', 'basic math')
-            
-            # Generate step-by-step solution
-            solution = self.solve_step_by_step(
-                problem=question,
-                problem_type=problem_type,
-                difficulty_level=assessed_difficulty
-            )
-            
-            # Extract solution components
-            solution_steps = self._parse_solution_steps(getattr(solution, 'solution_steps', ''))
-            verification_code = getattr(solution, 'verification_code', '')
-            final_answer = getattr(solution, 'final_answer', 'Unable to determine')
-            
-            # Verify the solution if code is provided
-            is_verified = False
-            verification_explanation = ""
-            
-            if verification_code:
-                try:
-                    verification = self.verify_solution(
-                        problem=question,
-                        solution_steps='\n'.join(solution_steps),
-                        verification_code=verification_code
-                    )
-                    is_verified = getattr(verification, 'is_correct', False)
-                    verification_explanation = getattr(verification, 'explanation', '')
-                except Exception as e:
-                    print(f"Verification error: {e}")
-                    verification_explanation = "Could not verify solution automatically"
-            
-            # Adapt explanation to student level
-            adapted_explanation = self.adapt_explanation(
-                solution_steps='\n'.join(solution_steps),
-                student_level=student_level
-            )
-            
-            # Generate practice problems
-            practice_problems = []
-            try:
-                practice = self.generate_practice(
-                    solved_problem=question,
-                    difficulty_level=assessed_difficulty,
-                    concepts=required_concepts
-                )
-                practice_problems = self._parse_practice_problems(
-                    getattr(practice, 'similar_problems', '')
-                )
-            except Exception as e:
-                print(f"Practice generation error: {e}")
-            
-            # Construct comprehensive response
-            response_parts = [
-                f"**Problem Analysis:** {problem_type} problem involving {required_concepts}",
-                f"**Difficulty Level:** {assessed_difficulty}",
-                "",
-                "**Step-by-Step Solution:**"
-            ]
-            
+        
+        # Practice problems only need the classification, so generate them alongside the solution
+        practice_future = submit(
+            self._cached_call,
+            "generate_practice",
+            solved_problem=question,
+            difficulty_level=assessed_difficulty,
+            concepts=required_concepts
+        )
+        
+        # Generate step-by-step solution
+        solution = self._cached_call(
+            "solve_step_by_step",
+            problem=question,
+            problem_type=problem_type,
+            difficulty_level=assessed_difficulty
+        )
+        
+        # Extract solution components
+        raw_steps = output_field(solution, 'solution_steps')
+        solution_steps = self._parse_solution_steps(raw_steps) if raw_steps else []
+        verification_code = getattr(solution, 'verification_code', '')
+        final_answer = output_field(solution, 'final_answer')
+        
+        # Verify the solution (if code is provided) while adapting the explanation;
+        # both are skipped when there are no steps to work from
+        steps_text = '\n'.join(solution_steps)
+        verification_future = submit(
+            self._cached_call,
+            "verify_solution",
+            problem=question,
+            solution_steps=steps_text,
+            verification_code=verification_code
+        ) if verification_code and solution_steps else None
+        adapted_explanation_future = submit(
+            self._cached_call,
+            "adapt_explanation",
+            solution_steps=steps_text,
+            student_level=student_level
+        ) if solution_steps else None
+        
+        # The analysis and solution are ready before any follow-up call resolves
+        response_parts = [
+            f"**Problem Analysis:** {problem_type} problem involving {required_concepts}",
+            f"**Difficulty Level:** {assessed_difficulty}",
+            ""
+        ]
+        
+        # Sections the LM left empty are omitted rather than filled with placeholders
+        if solution_steps:
+            response_parts.append("**Step-by-Step Solution:**")
             for i, step in enumerate(solution_steps, 1):
                 response_parts.append(f"{i}. {step}")
-            
+            response_parts.append("")
+        
+        if final_answer:
             response_parts.extend([
-                "",
                 f"**Final Answer:** {final_answer}",
                 ""
             ])
-            
-            if verification_explanation:
-                response_parts.extend([
-                    f"**Verification:** {'✅ Verified' if is_verified else '⚠️ Needs Review'}",
-                    verification_explanation,
-                    ""
-                ])
-            
-            # Add adapted explanation
-            simplified_explanation = getattr(adapted_explanation, 'simplified_explanation', '')
-            if simplified_explanation and student_level in ['beginner', 'elementary']:
-                response_parts.extend([
-                    "**Simplified Explanation:**",
-                    simplified_explanation,
-                    ""
-                ])
-            
-            # Add visual aids suggestions
-            visual_aids = getattr(adapted_explanation, 'visual_aids_suggestions', '')
-            if visual_aids:
-                response_parts.extend([
-                    "**Visual Learning Tips:**",
-                    visual_aids,
-                    ""
-                ])
-            
-            return dspy.Prediction(
-                response='\n'.join(response_parts),
-                explanation=simplified_explanation,
-                next_steps=practice_problems[:3] if practice_problems else [
-                    "Try solving similar problems",
-                    "Review the concepts used in this solution",
-                    "Practice the calculation steps"
-                ],
-                solution_steps=solution_steps,
-                final_answer=final_answer,
-                is_verified=is_verified,
-                difficulty_assessment=assessed_difficulty,
-                practice_problems=practice_problems
+        
+        yield '\n'.join(response_parts) + '\n'
+        
+        is_verified = False
+        verification_explanation = ""
+        
+        if verification_future is not None:
+            try:
+                verification = verification_future.result()
+                is_verified = getattr(verification, 'is_correct', False)
+                verification_explanation = getattr(verification, 'explanation', '')
+            except Exception as e:
+                logger.error("Verification error: {}", e)
+                verification_explanation = "Could not verify solution automatically"
+        
+        if verification_explanation:
+            yield '\n'.join([
+                f"**Verification:** {'✅ Verified' if is_verified else '⚠️ Needs Review'}",
+                verification_explanation,
+                ""
+            ]) + '\n'
+        
+        # Adapt explanation to student level
+        adapted_explanation = adapted_explanation_future.result() if adapted_explanation_future else None
+        response_parts = []
+        
+        # Add adapted explanation
+        simplified_explanation = output_field(adapted_explanation, 'simplified_explanation')
+        if simplified_explanation and student_level in ['beginner', 'elementary']:
+            response_parts.extend([
+                "**Simplified Explanation:**",
+                simplified_explanation,
+                ""
+            ])
+        
+        # Add visual aids suggestions
+        visual_aids = output_field(adapted_explanation, 'visual_aids_suggestions')
+        if visual_aids:
+            response_parts.extend([
+                "**Visual Learning Tips:**",
+                visual_aids,
+                ""
+            ])
+        
+        if response_parts:
+            yield '\n'.join(response_parts) + '\n'
+        
+        # Collect practice problems
+        practice_problems = []
+        try:
+            practice = practice_future.result()
+            practice_problems = self._parse_practice_problems(
+                getattr(practice, 'similar_problems', '')
             )
-            
         except Exception as e:
-            print(f"Math tutor error: {e}")
-            return self._fallback_response(question)
+            logger.error("Practice generation error: {}", e)
+        
+        return dict(
+            explanation=simplified_explanation,
+            next_steps=practice_problems[:3] if practice_problems else [
+                "Try solving similar problems",
+                "Review the concepts used in this solution",
+                "Practice the calculation steps"
+            ],
+            solution_steps=solution_steps,
+            final_answer=final_answer,
+            is_verified=is_verified,
+            difficulty_assessment=assessed_difficulty,
+            practice_problems=practice_problems,
+            status=completion_status(raw_steps, final_answer)
+        )
     
     def _parse_solution_steps(self, solution_text: str) -> List[str]:
         """Parse solution steps from generated text"""
@@ -189,13 +286,13 @@ class MathTutor(dspy.Module):
         
         # Try to extract numbered steps
         steps = []
-        lines = solution_text.split('\n')
         
-        for line in lines:
+        for line in solution_text.split('\n'):
             line = line.strip()
             if line and (line[0].isdigit() or line.startswith('Step')):
                 # Remove step numbering
-                clean_step = re.sub(r'^\d+\.?\s*|^Step\s*\d+:?\s*', '', line)
+                numbering = _STEP_NUMBERING_RE.match(line)
+                clean_step = line[numbering.end():] if numbering else line
                 if clean_step:
                     steps.append(clean_step)
             elif line and not steps:
@@ -210,37 +307,31 @@ class MathTutor(dspy.Module):
             return []
         
         problems = []
-        lines = practice_text.split('\n')
         
-        for line in lines:
+        for line in practice_text.split('\n'):
             line = line.strip()
             if line and (line[0].isdigit() or '?' in line or '=' in line):
                 # Clean up problem formatting
-                clean_problem = re.sub(r'^\d+\.?\s*', '', line)
+                numbering = _PROBLEM_NUMBERING_RE.match(line)
+                clean_problem = line[numbering.end():] if numbering else line
                 if clean_problem:
                     problems.append(clean_problem)
+                    if len(problems) == 5:  # Limit to 5 practice problems
+                        break
         
-        return problems[:5]  # Limit to 5 practice problems
+        return problems
     
     def _fallback_response(self, question: str):
         """Fallback response when main processing fails"""
         return dspy.Prediction(
-            response=f"I understand you're working on this math problem: {question}\n\n"
-                    "Let me help you approach this step by step:\n"
-                    "1. First, let's identify what type of problem this is\n"
-                    "2. Then we'll break it down into manageable steps\n"
-                    "3. Finally, we'll solve it together\n\n"
-                    "Could you provide any additional context or specify what part you're struggling with?",
+            response=f"I understand you're working on this math problem: {question}\n\n{_FALLBACK_GUIDANCE}",
             explanation="This is a general approach to mathematical problem solving.",
-            next_steps=[
-                "Identify the problem type",
-                "Break down into steps",
-                "Apply relevant mathematical concepts"
-            ],
-            solution_steps=["Analyze the problem", "Apply mathematical principles", "Verify the solution"],
+            next_steps=list(_FALLBACK_NEXT_STEPS),
+            solution_steps=list(_FALLBACK_SOLUTION_STEPS),
             final_answer="Pending detailed analysis",
             is_verified=False,
-            difficulty_assessment="unknown"
+            difficulty_assessment="unknown",
+            status="fallback"
         )
 
 
@@ -253,30 +344,40 @@ class AdvancedMathTutor(MathTutor):
         super().__init__()
         
         # Advanced problem classification
-        self.classify_advanced = dspy.Predict(
-            "problem -> math_field, complexity_level, prerequisites, solution_approach"
-        )
+        self.classify_advanced = dspy.Predict(_CLASSIFY_ADVANCED_SIG)
         
         # Concept explanation for advanced topics
-        self.explain_concepts = dspy.ChainOfThought(
-            "math_field, concepts, student_background -> conceptual_explanation, intuitive_understanding, applications"
-        )
+        self.explain_concepts = dspy.ChainOfThought(_EXPLAIN_ADVANCED_CONCEPTS_SIG)
     
     def forward(self, question: str, math_field: str = "general", **kwargs):
         """Enhanced forward method for advanced mathematics"""
         
         # First classify as advanced problem
-        advanced_classification = self.classify_advanced(problem=question)
+        with classifier_context():
+            advanced_classification = self._cached_call("classify_advanced", problem=question[:_CLASSIFY_MAX_CHARS])
+        field = getattr(advanced_classification, 'math_field', math_field)
+        prerequisites = getattr(advanced_classification, 'prerequisites', 'basic concepts')
         
-        # Get conceptual explanation
-        concepts_explanation = self.explain_concepts(
-            math_field=getattr(advanced_classification, 'math_field', math_field),
-            concepts=getattr(advanced_classification, 'prerequisites', 'basic concepts'),
+        # Get conceptual explanation while the parent solves the problem
+        concepts_future = submit(
+            self._cached_call,
+            "explain_concepts",
+            math_field=field,
+            concepts=prerequisites,
             student_background=kwargs.get('student_level', 'intermediate')
         )
         
-        # Call parent method for solution
-        result = super().forward(question, **kwargs)
+        # Call parent method for solution, reusing the advanced classification
+        result = super().forward(
+            question,
+            _preclassified=(
+                field,
+                getattr(advanced_classification, 'complexity_level', kwargs.get('difficulty_level', 'intermediate')),
+                prerequisites
+            ),
+            **kwargs
+        )
+        concepts_explanation = concepts_future.result()
         
         # Enhance with conceptual understanding
         conceptual_explanation = getattr(concepts_explanation, 'conceptual_explanation', '')
@@ -304,5 +405,6 @@ class AdvancedMathTutor(MathTutor):
             is_verified=result.is_verified,
             difficulty_assessment=result.difficulty_assessment,
             conceptual_explanation=conceptual_explanation,
-            applications=applications
+            applications=applications,
+            status=result.status
         )
@@ -4,8 +4,64 @@ Replaces the current vectorMemoryService.js with optimizable DSPy components
 """
 
 import dspy
+import os
+import hashlib
+from itertools import islice
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
+from loguru import logger
+
+from modules._cache import TTLCache, predictor_fingerprint, tracing
+from modules._executor import submit
+from modules._fields import prediction_json
+
+
+# analyze_content outputs passed on to the multimodal response step
+_CONTENT_ANALYSIS_FIELDS = ('content_summary', 'key_concepts', 'educational_focus')
+
+# Answers to the same question, up to case and whitespace, asked over the same context
+_response_cache = TTLCache(
+    maxsize=int(os.getenv("RAG_RESPONSE_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("RAG_RESPONSE_CACHE_TTL", "3600"))
+)
+
+
+def _canonical_passages(passages, k: int) -> List[str]:
+    """Top-k passages in content-hash order, so the same set always yields the same prompt prefix"""
+    # islice feeds sorted() directly, so the sorted list is the only copy of the results
+    return sorted(islice(passages, k), key=lambda passage: hashlib.blake2b(str(passage).encode(), digest_size=8).digest())
+
+
+# Characters of uploaded file content put into one prompt, and the per-file bounds within that
+_FILE_CONTENT_BUDGET = int(os.getenv("MULTIMODAL_FILE_CONTENT_BUDGET", "4000"))
+_FILE_CONTENT_MIN_CHARS = 200
+_FILE_CONTENT_MAX_CHARS = 500
+
+
+def _describe_files(files_content: List[Dict]) -> str:
+    """One line per uploaded file, keeping the included content within the prompt budget"""
+    per_file = min(_FILE_CONTENT_MAX_CHARS, max(_FILE_CONTENT_MIN_CHARS, _FILE_CONTENT_BUDGET // len(files_content)))
+    # Explicitly prioritized files first, then smaller ones so more files fit whole
+    ordered = sorted(files_content, key=lambda file: (-file.get('priority', 0), len(file.get('content') or '')))
+    
+    file_lines = []
+    remaining = _FILE_CONTENT_BUDGET
+    for file in ordered:
+        if remaining <= 0:
+            file_lines.append(f"({len(ordered) - len(file_lines)} more files omitted)")
+            break
+        content = file.get('content', 'No content')[:min(per_file, remaining)]
+        remaining -= len(content)
+        file_lines.append(
+            f"File: {file.get('name', 'unknown')} - Type: {file.get('type', 'unknown')} - Content: {content}..."
+        )
+    return "\n".join(file_lines)
+
+
+def _retrieve_passages(retriever, question: str, k: int) -> List[str]:
+    """Canonically ordered top-k passages for a question; each forward retrieves once and reuses the list"""
+    retrieval_results = retriever(question, k=k)
+    return _canonical_passages(retrieval_results.passages, k) if hasattr(retrieval_results, 'passages') else []
 
 
 class TutorResponse(BaseModel):
@@ -30,9 +86,10 @@ class TutorRAG(dspy.Module):
         # Initialize retriever (will be configured with vector service)
         self.retrieve = None  # Will be set by vector service
         
-        # Core tutoring module with structured output
+        # Core tutoring module with structured output; the student level leads the context
+        # rather than being its own field, so prompts share a stable prefix
         self.respond = dspy.ChainOfThought(
-            "context, question, difficulty_level -> response, explanation, next_steps"
+            "context, question -> response, explanation, next_steps"
         )
         
         # Confidence assessment module
@@ -46,10 +103,16 @@ class TutorRAG(dspy.Module):
         )
     
     def set_retriever(self, retriever):
-        """Set the retriever component"""
+        """
+        Set the retriever component
+        
+        Passages may be plain text or dicts; dicts carrying a ``source_url`` opt the
+        response into LM source attribution, otherwise sources are numbered labels.
+        """
         self.retrieve = retriever
     
-    def forward(self, question: str, context: List[Dict] = None, difficulty_level: str = "intermediate", **kwargs):
+    def forward(self, question: str, context: List[Dict] = None, difficulty_level: str = "intermediate",
+                no_cache: bool = False, **kwargs):
         """
         Forward pass through the tutoring pipeline
         
@@ -57,78 +120,98 @@ class TutorRAG(dspy.Module):
             question: Student's question
             context: Previous conversation context
             difficulty_level: Student's current level (beginner, intermediate, advanced)
+            no_cache: Skip the response cache, e.g. for sensitive prompts
             **kwargs: Additional context parameters
         """
         
         # Retrieve relevant information if retriever is available
         retrieved_context = ""
         sources = []
+        has_real_sources = False
         
         if self.retrieve:
             try:
-                retrieval_results = self.retrieve(question, k=self.k)
-                if hasattr(retrieval_results, 'passages'):
-                    retrieved_context = "\n".join([
-                        f"[{i+1}] {passage}" 
-                        for i, passage in enumerate(retrieval_results.passages[:self.k])
-                    ])
-                    sources = [f"Source {i+1}" for i in range(len(retrieval_results.passages[:self.k]))]
+                passage_lines = []
+                for i, passage in enumerate(_retrieve_passages(self.retrieve, question, self.k), 1):
+                    passage_lines.append(f"[{i}] {passage}")
+                    sources.append(f"Source {i}")
+                    has_real_sources = has_real_sources or (isinstance(passage, dict) and bool(passage.get("source_url")))
+                retrieved_context = "\n".join(passage_lines)
             except Exception as e:
-                print(f"Retrieval error: {e}")
+                logger.warning("Retrieval error: {}", e)
                 retrieved_context = ""
         
         # Prepare conversation context
         conversation_context = ""
         if context:
-            conversation_context = "\n".join([
-                f"Previous: {item.get('message', '')}" 
-                for item in context[-3:]  # Last 3 exchanges
-            ])
+            history_lines = []
+            for item in context[-3:]:  # Last 3 exchanges
+                history_lines.append(f"Previous: {item.get('message', '')}")
+            conversation_context = "\n".join(history_lines)
         
-        # Combine all context
-        full_context = f"""
-Retrieved Information:
-{retrieved_context}
-
-Conversation History:
-{conversation_context}
-
-Student Level: {difficulty_level}
-""".strip()
+        # Combine all context, most stable parts first so provider prefix caches can reuse them
+        full_context = "\n".join([
+            f"Student Level: {difficulty_level}",
+            "",
+            "Retrieved Information:",
+            retrieved_context,
+            "",
+            "Conversation History:",
+            conversation_context
+        ]).rstrip()
+        
+        # Reuse the answer to the same question asked over the same context by the same program;
+        # never while an optimizer is tracing, since a cached answer records no trace
+        use_cache = not no_cache and not tracing()
+        if use_cache:
+            digest = hashlib.blake2b(predictor_fingerprint(self.respond), digest_size=16)
+            digest.update(full_context.encode())
+            digest.update(b"\0")
+            digest.update(" ".join(question.casefold().split()).encode())
+            cache_key = digest.digest()
+            cached = _response_cache.get(cache_key)
+            if cached is not None:
+                return cached
         
         # Generate structured response
         try:
             result = self.respond(
                 context=full_context,
-                question=question,
-                difficulty_level=difficulty_level
+                question=question
             )
             
-            # Assess confidence in the response
-            confidence_result = self.assess_confidence(
+            # Assess confidence and attribute sources (only when passages carry source
+            # metadata the LM can cite); both only need the response, so they run concurrently
+            confidence_future = submit(
+                self.assess_confidence,
                 question=question,
                 response=result.response,
                 context=full_context
             )
+            source_future = submit(
+                self.attribute_sources,
+                context=retrieved_context,
+                response=result.response
+            ) if retrieved_context and has_real_sources else None
             
-            # Attribute sources if we have retrieved context
-            if retrieved_context and sources:
-                source_result = self.attribute_sources(
-                    context=retrieved_context,
-                    response=result.response
-                )
+            confidence_result = confidence_future.result()
+            if source_future is not None:
+                source_result = source_future.result()
                 sources = source_result.sources if hasattr(source_result, 'sources') else sources
             
-            return dspy.Prediction(
+            prediction = dspy.Prediction(
                 response=result.response,
                 explanation=getattr(result, 'explanation', None),
                 next_steps=getattr(result, 'next_steps', '').split('\n') if hasattr(result, 'next_steps') else None,
                 confidence=float(confidence_result.confidence) if hasattr(confidence_result, 'confidence') else None,
                 sources=sources
             )
+            if use_cache:
+                _response_cache.put(cache_key, prediction)
+            return prediction
             
         except Exception as e:
-            print(f"Response generation error: {e}")
+            logger.error("Response generation error: {}", e)
             # Fallback response
             return dspy.Prediction(
                 response=f"I understand you're asking about: {question}. Let me help you with that.",
@@ -139,6 +222,15 @@ Student Level: {difficulty_level}
             )
 
 
+    def answer_batch(self, questions: List[str], difficulty_level: str = "intermediate", num_threads: int = 16):
+        """Answer several independent questions in parallel through dspy.Module.batch"""
+        examples = [
+            dspy.Example(question=question, difficulty_level=difficulty_level).with_inputs("question", "difficulty_level")
+            for question in questions
+        ]
+        return self.batch(examples, num_threads=num_threads, disable_progress_bar=True)
+
+
 class ContextualTutorRAG(dspy.Module):
     """
     Advanced RAG module that adapts responses based on student performance history
@@ -168,29 +260,29 @@ class ContextualTutorRAG(dspy.Module):
         Generate adaptive response based on student's learning profile
         """
         
-        # Retrieve relevant information
-        retrieved_context = ""
-        if self.retrieve:
-            try:
-                retrieval_results = self.retrieve(question, k=self.k)
-                if hasattr(retrieval_results, 'passages'):
-                    retrieved_context = "\n".join(retrieval_results.passages[:self.k])
-            except Exception as e:
-                print(f"Retrieval error: {e}")
+        # Retrieve relevant information while the student is assessed; neither needs the other
+        retrieval_future = submit(_retrieve_passages, self.retrieve, question, self.k) if self.retrieve else None
         
         # Assess student based on conversation history
         conversation_history = ""
         if context:
-            conversation_history = "\n".join([
-                f"Q: {item.get('user_message', '')} A: {item.get('ai_response', '')}"
-                for item in context[-5:]  # Last 5 exchanges
-            ])
+            history_lines = []
+            for item in context[-5:]:  # Last 5 exchanges
+                history_lines.append(f"Q: {item.get('user_message', '')} A: {item.get('ai_response', '')}")
+            conversation_history = "\n".join(history_lines)
         
         student_assessment = self.assess_student(
             conversation_history=conversation_history,
             current_question=question
         )
         
+        retrieved_context = ""
+        if retrieval_future is not None:
+            try:
+                retrieved_context = "\n".join(retrieval_future.result())
+            except Exception as e:
+                logger.warning("Retrieval error: {}", e)
+        
         # Generate adaptive response
         result = self.adaptive_respond(
             context=retrieved_context,
@@ -247,19 +339,14 @@ class MultiModalTutorRAG(dspy.Module):
         retrieved_context = ""
         if self.retrieve:
             try:
-                retrieval_results = self.retrieve(question, k=self.k)
-                if hasattr(retrieval_results, 'passages'):
-                    retrieved_context = "\n".join(retrieval_results.passages[:self.k])
+                retrieved_context = "\n".join(_retrieve_passages(self.retrieve, question, self.k))
             except Exception as e:
-                print(f"Retrieval error: {e}")
+                logger.warning("Retrieval error: {}", e)
         
         # Analyze uploaded content
         content_analysis = None
         if files_content:
-            file_descriptions = "\n".join([
-                f"File: {file.get('name', 'unknown')} - Type: {file.get('type', 'unknown')} - Content: {file.get('content', 'No content')[:500]}..."
-                for file in files_content
-            ])
+            file_descriptions = _describe_files(files_content)
             
             content_analysis = self.analyze_content(
                 text_content=retrieved_context,
@@ -270,7 +357,7 @@ class MultiModalTutorRAG(dspy.Module):
         # Generate multimodal response
         result = self.multimodal_respond(
             context=retrieved_context,
-            content_analysis=str(content_analysis) if content_analysis else "No file content provided",
+            content_analysis=prediction_json(content_analysis, _CONTENT_ANALYSIS_FIELDS) if content_analysis else "No file content provided",
             question=question
         )
         
@@ -4,16 +4,61 @@ Handles systematic optimization of tutoring modules using Google Gemini
 """
 
 import os
+import gzip
+import mmap
+import random
+import hashlib
+import functools
+import threading
 import asyncio
-import json
-from typing import List, Dict, Any, Optional, Callable
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Callable, Tuple
 from datetime import datetime
 import pickle
 
+import cloudpickle
 import dspy
+import orjson
 from loguru import logger
 
 
+# Optimized modules are stored as gzip-compressed cloudpickles; plain .pkl files are still loadable
+_MODULE_SUFFIX = "_module.pkl.gz"
+_LEGACY_MODULE_SUFFIX = "_module.pkl"
+_MODULE_COMPRESSLEVEL = 6
+
+# Share of stale lines in history.jsonl that triggers rewriting it during cleanup
+_HISTORY_COMPACT_RATIO = 0.25
+
+# Phrases whose presence marks an explanatory response
+_EDUCATIONAL_INDICATORS = (
+    "because", "therefore", "for example", "step", "first", "second", "next",
+    "explanation", "understand", "concept", "principle", "rule", "method"
+)
+
+# Indicator count at which that part of the score is maxed out
+_INDICATOR_SATURATION = 5
+
+# Characters that indicate structured formatting
+_STRUCTURE_CHARS = (':', '-', '•')
+
+
+@lru_cache(maxsize=65536)
+def _tokenize(text: str) -> Tuple[frozenset, str]:
+    """Distinct lowercased words and the lowercased text of a response; optimizers score the same texts repeatedly"""
+    lower = text.lower()
+    return frozenset(lower.split()), lower
+
+
+def _read_module(path: str, compressed: bool):
+    """Unpickle a stored module from a memory map, so pages are read as the unpickler reaches them"""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        if compressed:
+            with gzip.GzipFile(fileobj=mapped) as stream:
+                return pickle.load(stream)
+        return pickle.load(mapped)
+
+
 class OptimizationService:
     """
     Service for optimizing DSPy modules using various optimizers
@@ -22,29 +67,47 @@ class OptimizationService:
     
     def __init__(self):
         self.optimizers = {}
+        self._optimizer_factories = {}
         self.optimization_history = {}
         self.cache_dir = os.getenv("OPTIMIZATION_CACHE_DIR", "./cache")
+        self.max_examples = int(os.getenv("MAX_OPTIMIZATION_EXAMPLES", "500"))
         self.is_initialized = False
         
-        # Create cache directory
-        os.makedirs(self.cache_dir, exist_ok=True)
+        # Create cache directory and its content-addressed module store
+        self.objects_dir = os.path.join(self.cache_dir, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        
+        # Append-only optimization history, so runs survive restarts
+        self.history_path = os.path.join(self.cache_dir, "history.jsonl")
+        self._history_file = None
+        self._history_lines = 0
+        self._history_lock = threading.Lock()
     
     async def initialize(self):
         """Initialize optimization service"""
         try:
-            # Initialize different optimizers
-            self.optimizers = {
-                "mipro_v2": dspy.MIPROv2(
+            self._load_history()
+            
+            # Concurrent LM calls while scoring candidates; optimization is LM-bound
+            optimizer_threads = int(os.getenv("OPTIMIZER_THREADS", "32"))
+            
+            # Optimizers are built on first use; small datasets never need MIPROv2
+            self._optimizer_factories = {
+                "mipro_v2": functools.partial(
+                    dspy.MIPROv2,
                     metric=self._educational_effectiveness_metric,
                     auto="light",  # Use light mode for faster optimization
-                    num_threads=4
+                    num_threads=optimizer_threads
                 ),
-                "bootstrap_rs": dspy.BootstrapRS(
+                "bootstrap_rs": functools.partial(
+                    dspy.BootstrapRS,
                     metric=self._educational_effectiveness_metric,
                     max_bootstrapped_demos=3,
-                    max_labeled_demos=3
+                    max_labeled_demos=3,
+                    num_threads=optimizer_threads
                 ),
-                "bootstrap_fewshot": dspy.BootstrapFewShot(
+                "bootstrap_fewshot": functools.partial(
+                    dspy.BootstrapFewShot,
                     metric=self._educational_effectiveness_metric,
                     max_bootstrapped_demos=5
                 )
@@ -81,18 +144,26 @@ class OptimizationService:
             # Convert training examples to DSPy format
             trainset = self._convert_to_dspy_examples(training_examples)
             
+            # Every extra example multiplies the optimizer's scoring calls, so large sets are sampled down
+            if len(trainset) > self.max_examples:
+                logger.info(f"Sampling {self.max_examples} of {len(trainset)} training examples")
+                trainset = random.Random(0).sample(trainset, self.max_examples)
+            
             if len(trainset) < 5:
                 logger.warning(f"Only {len(trainset)} training examples available. Optimization may be limited.")
             
             # Select optimizer based on dataset size and requirements
             optimizer_name = self._select_optimizer(len(trainset), metric_name)
-            optimizer = self.optimizers[optimizer_name]
+            optimizer = self.optimizers.get(optimizer_name)
+            if optimizer is None:
+                optimizer = self.optimizers[optimizer_name] = self._optimizer_factories[optimizer_name]()
             
             logger.info(f"Using optimizer: {optimizer_name}")
             
-            # Run optimization
+            # Run optimization off the event loop so the service keeps answering requests
             start_time = datetime.now()
-            optimized_module = optimizer.compile(
+            optimized_module = await asyncio.to_thread(
+                optimizer.compile,
                 module, 
                 trainset=trainset,
                 requires_permission_to_run=False
@@ -119,6 +190,10 @@ class OptimizationService:
                 "duration_seconds": (end_time - start_time).total_seconds(),
                 "status": "completed"
             }
+            self._append_history(optimization_id)
+            
+            # Release the texts memoized for this run's metric calls
+            _tokenize.cache_clear()
             
             logger.info(f"Optimization completed for {module_name} in {(end_time - start_time).total_seconds():.2f} seconds")
             
@@ -133,11 +208,65 @@ class OptimizationService:
         except Exception as e:
             logger.error(f"Error optimizing module {module_name}: {e}")
             # Record failed optimization
-            if 'optimization_id' in locals():
+            if 'optimization_id' in locals() and optimization_id in self.optimization_history:
                 self.optimization_history[optimization_id]["status"] = "failed"
                 self.optimization_history[optimization_id]["error"] = str(e)
+                self._append_history(optimization_id)
             raise
     
+    def _load_history(self):
+        """Rebuild the history from history.jsonl and open it for appending"""
+        if os.path.exists(self.history_path):
+            with open(self.history_path, "rb") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    self._history_lines += 1
+                    record = orjson.loads(line)
+                    optimization_id = record.pop("optimization_id")
+                    # Later records for the same run supersede earlier ones; a tombstone removes it
+                    if record.get("deleted"):
+                        self.optimization_history.pop(optimization_id, None)
+                    else:
+                        self.optimization_history[optimization_id] = record
+        self._history_file = open(self.history_path, "ab")
+    
+    def _append_history(self, optimization_id: str):
+        """Append the current record for an optimization to history.jsonl"""
+        if self._history_file is None:
+            return
+        line = orjson.dumps({"optimization_id": optimization_id, **self.optimization_history[optimization_id]})
+        with self._history_lock:
+            self._history_file.write(line + b"\n")
+            self._history_file.flush()
+            self._history_lines += 1
+    
+    def _append_tombstones(self, optimization_ids: List[str]):
+        """Record removed optimizations in history.jsonl so they stay removed after a restart"""
+        if self._history_file is None or not optimization_ids:
+            return
+        lines = b"".join(
+            orjson.dumps({"optimization_id": optimization_id, "deleted": True}) + b"\n"
+            for optimization_id in optimization_ids
+        )
+        with self._history_lock:
+            self._history_file.write(lines)
+            self._history_file.flush()
+            self._history_lines += len(optimization_ids)
+    
+    def _compact_history(self):
+        """Rewrite history.jsonl with one line per remaining optimization"""
+        temp_path = f"{self.history_path}.tmp"
+        with self._history_lock:
+            with open(temp_path, "wb") as f:
+                for optimization_id, record in self.optimization_history.items():
+                    f.write(orjson.dumps({"optimization_id": optimization_id, **record}) + b"\n")
+            if self._history_file is not None:
+                self._history_file.close()
+            os.replace(temp_path, self.history_path)
+            self._history_file = open(self.history_path, "ab")
+            self._history_lines = len(self.optimization_history)
+    
     def _convert_to_dspy_examples(self, training_examples: List[Dict[str, Any]]) -> List[dspy.Example]:
         """Convert training examples to DSPy format"""
         
@@ -173,6 +302,8 @@ class OptimizationService:
                 # Create DSPy example
                 if inputs and outputs:
                     dspy_example = dspy.Example(**inputs, **outputs).with_inputs(*inputs.keys())
+                    # Expected-side metric features, computed once instead of on every re-scoring
+                    dspy_example._expected_words = _tokenize(outputs["response"])[0]
                     dspy_examples.append(dspy_example)
                 
             except Exception as e:
@@ -210,11 +341,13 @@ class OptimizationService:
             score = 0.0
             
             # 1. Content relevance (basic keyword overlap)
-            expected_words = set(expected.lower().split())
-            predicted_words = set(predicted.lower().split())
+            expected_words = getattr(example, '_expected_words', None)
+            if expected_words is None:
+                expected_words = _tokenize(expected)[0]
+            predicted_words, predicted_lower = _tokenize(predicted)
             
             if expected_words:
-                overlap_ratio = len(expected_words.intersection(predicted_words)) / len(expected_words)
+                overlap_ratio = len(expected_words & predicted_words) / len(expected_words)
                 score += overlap_ratio * 0.3
             
             # 2. Response completeness (length similarity)
@@ -222,19 +355,19 @@ class OptimizationService:
             score += length_ratio * 0.2
             
             # 3. Educational indicators (presence of explanatory elements)
-            educational_indicators = [
-                "because", "therefore", "for example", "step", "first", "second", "next",
-                "explanation", "understand", "concept", "principle", "rule", "method"
-            ]
-            
-            indicator_count = sum(1 for indicator in educational_indicators if indicator in predicted.lower())
-            score += min(indicator_count / 5, 1.0) * 0.3
+            indicator_count = 0
+            for indicator in _EDUCATIONAL_INDICATORS:
+                if indicator in predicted_lower:
+                    indicator_count += 1
+                    if indicator_count == _INDICATOR_SATURATION:
+                        break  # Further matches cannot raise the score
+            score += min(indicator_count / _INDICATOR_SATURATION, 1.0) * 0.3
             
             # 4. Structure and clarity (basic checks)
-            if len(predicted.split('.')) > 1:  # Multiple sentences
+            if '.' in predicted:  # Multiple sentences
                 score += 0.1
             
-            if any(char in predicted for char in [':', '-', '•']):  # Structured formatting
+            if any(char in predicted for char in _STRUCTURE_CHARS):  # Structured formatting
                 score += 0.1
             
             return min(score, 1.0)  # Cap at 1.0
@@ -247,15 +380,29 @@ class OptimizationService:
         """Save optimized module to cache"""
         
         try:
-            # Save module
-            module_path = os.path.join(self.cache_dir, f"{optimization_id}_module.pkl")
-            with open(module_path, 'wb') as f:
-                pickle.dump(module, f)
+            # Save module; identical modules share one stored blob through hardlinks
+            payload = gzip.compress(cloudpickle.dumps(module), compresslevel=_MODULE_COMPRESSLEVEL, mtime=0)
+            object_path = os.path.join(self.objects_dir, f"{hashlib.sha256(payload).hexdigest()}.pkl.gz")
+            if not os.path.exists(object_path):
+                temp_path = f"{object_path}.{os.getpid()}.tmp"
+                with open(temp_path, 'wb') as f:
+                    f.write(payload)
+                os.replace(temp_path, object_path)
+            
+            module_path = os.path.join(self.cache_dir, f"{optimization_id}{_MODULE_SUFFIX}")
+            if os.path.exists(module_path):
+                os.remove(module_path)
+            try:
+                os.link(object_path, module_path)
+            except OSError:
+                # Filesystem without hardlinks: store a private copy instead
+                with open(module_path, 'wb') as f:
+                    f.write(payload)
             
             # Save metadata
             metadata_path = os.path.join(self.cache_dir, f"{optimization_id}_metadata.json")
-            with open(metadata_path, 'w') as f:
-                json.dump(metadata, f, indent=2)
+            with open(metadata_path, 'wb') as f:
+                f.write(orjson.dumps(metadata))
             
             logger.debug(f"Saved optimized module: {optimization_id}")
             
@@ -266,16 +413,19 @@ class OptimizationService:
         """Load optimized module from cache"""
         
         try:
-            module_path = os.path.join(self.cache_dir, f"{optimization_id}_module.pkl")
+            module_path = os.path.join(self.cache_dir, f"{optimization_id}{_MODULE_SUFFIX}")
+            legacy_path = os.path.join(self.cache_dir, f"{optimization_id}{_LEGACY_MODULE_SUFFIX}")
             
+            # Unpickle off the event loop; large modules take a while
             if os.path.exists(module_path):
-                with open(module_path, 'rb') as f:
-                    module = pickle.load(f)
-                
-                logger.debug(f"Loaded optimized module: {optimization_id}")
-                return module
+                module = await asyncio.to_thread(_read_module, module_path, True)
+            elif os.path.exists(legacy_path):
+                module = await asyncio.to_thread(_read_module, legacy_path, False)
+            else:
+                return None
             
-            return None
+            logger.debug(f"Loaded optimized module: {optimization_id}")
+            return module
             
         except Exception as e:
             logger.error(f"Error loading optimized module: {e}")
@@ -302,13 +452,29 @@ class OptimizationService:
                 del self.optimization_history[opt_id]
                 
                 # Remove cache files
-                module_path = os.path.join(self.cache_dir, f"{opt_id}_module.pkl")
+                module_path = os.path.join(self.cache_dir, f"{opt_id}{_MODULE_SUFFIX}")
+                legacy_path = os.path.join(self.cache_dir, f"{opt_id}{_LEGACY_MODULE_SUFFIX}")
                 metadata_path = os.path.join(self.cache_dir, f"{opt_id}_metadata.json")
                 
-                for path in [module_path, metadata_path]:
+                for path in [module_path, legacy_path, metadata_path]:
                     if os.path.exists(path):
                         os.remove(path)
             
+            self._append_tombstones(to_remove)
+            
+            # Drop stored modules no optimization links to any more
+            for name in os.listdir(self.objects_dir):
+                if not name.endswith(".pkl.gz"):
+                    continue  # Blob still being written
+                object_path = os.path.join(self.objects_dir, name)
+                if os.stat(object_path).st_nlink == 1:
+                    os.remove(object_path)
+            
+            # Rewrite the history once enough of it is stale
+            stale_lines = self._history_lines - len(self.optimization_history)
+            if self._history_lines and stale_lines / self._history_lines > _HISTORY_COMPACT_RATIO:
+                self._compact_history()
+            
             logger.info(f"Cleaned up {len(to_remove)} old optimizations")
             
         except Exception as e:
@@ -324,6 +490,6 @@ class OptimizationService:
             "is_initialized": self.is_initialized,
             "total_optimizations": total_optimizations,
             "successful_optimizations": successful_optimizations,
-            "available_optimizers": list(self.optimizers.keys()),
+            "available_optimizers": list(self._optimizer_factories.keys()),
             "cache_directory": self.cache_dir
         }
@@ -4,18 +4,77 @@ Replaces the Node.js vectorMemoryService with DSPy-optimized retrieval using onl
 """
 
 import os
+import time
 import asyncio
+import hashlib
 import json
+from bisect import bisect_right
+from collections import OrderedDict
 from typing import List, Dict, Any, Optional
-from datetime import datetime, timedelta
+from datetime import datetime
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 
 import dspy
 import google.generativeai as genai
+from google.ai import generativelanguage as glm
 from loguru import logger
 
 
+_EMBEDDING_MODEL = "models/gemini-embedding-001"
+_EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "768"))
+
+# Storage dtype of embeddings; float16 halves memory, similarity math still runs in float32
+_EMBEDDING_DTYPE = np.dtype(os.getenv("EMBEDDING_DTYPE", "float32"))
+
+# Embeddings kept in memory, keyed by model and text, so repeated texts skip the API
+_EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+
+# Texts per embedding request, and how many batch requests may be in flight at once
+_EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+_EMBED_BATCH_CONCURRENCY = int(os.getenv("EMBED_BATCH_CONCURRENCY", "5"))
+
+# Texts shorter than this once stripped get a zero embedding instead of an API call
+_MIN_EMBED_CHARS = 3
+
+
+def _hash_embedding(text: str) -> np.ndarray:
+    """Deterministic hash-based embedding of the configured size, used when the embedding API is unavailable"""
+    raw = hashlib.shake_256(text.encode()).digest(_EMBEDDING_DIMENSIONS * 4)
+    return (np.frombuffer(raw, dtype=np.uint32) / np.float32(2 ** 32)).astype(_EMBEDDING_DTYPE)
+
+
+def _is_blank(text: str) -> bool:
+    """Whether a text is too short to be worth embedding"""
+    return not text or len(text.strip()) < _MIN_EMBED_CHARS
+
+
+def _blank_embedding(dimensions: int) -> np.ndarray:
+    """Zero embedding, which scores zero against everything"""
+    return np.zeros(dimensions, dtype=_EMBEDDING_DTYPE)
+
+
+def _norm_sq(embedding: np.ndarray) -> float:
+    """Self-dot of an embedding, accumulated in float32 whatever the storage dtype"""
+    vector = np.asarray(embedding, dtype=np.float32)
+    return float(np.vdot(vector, vector))
+
+
+def _embedding_key(text: str) -> bytes:
+    """Content address of an embedding"""
+    return hashlib.blake2b(f"{_EMBEDDING_MODEL}\0{text}".encode(), digest_size=16).digest()
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first; argpartition avoids sorting every score"""
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k < len(scores):
+        top = np.argpartition(-scores, k)[:k]
+    else:
+        top = np.arange(len(scores))
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
 class GeminiVectorService:
     """
     Enhanced vector service using DSPy retrievers with Google Gemini embeddings
@@ -24,12 +83,28 @@ class GeminiVectorService:
 
     def __init__(self):
         self.genai_client = None
+        self._embed_client: Optional[glm.GenerativeServiceClient] = None
         self.embedder = None
         self.retriever = None
         self.vector_store = {}  # In-memory store for now
         self.conversation_store = {}
         self.document_store = {}
         self.is_initialized = False
+        
+        # L2-normalized document embeddings, one row per document in a buffer grown by doubling;
+        # only deletions and mixed dimensionalities force a rebuild
+        self._doc_matrix: Optional[np.ndarray] = None
+        self._doc_ids: List[str] = []
+        self._doc_rows: Dict[str, int] = {}
+        self._doc_count = 0
+        self._doc_dim: Optional[int] = None
+        self._doc_dirty = False
+        self._embedding_cache = OrderedDict()
+        # Size of the embeddings the API returns, so zero embeddings line up with real ones
+        self._embedding_dimensions = _EMBEDDING_DIMENSIONS
+        
+        # Texts handed to the retriever, appended to as content is stored
+        self._corpus: List[str] = []
 
         # DSPy retrieval components
         self.query_optimizer = None
@@ -43,7 +118,8 @@ class GeminiVectorService:
             if not api_key:
                 raise ValueError("GOOGLE_API_KEY environment variable is required")
 
-            genai.configure(api_key=api_key)
+            # Service-owned client, so embedding calls neither read nor reset genai's global configuration
+            self._embed_client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
             self.genai_client = genai
 
             # Skip DSPy embedder initialization for now - use simple fallback
@@ -77,6 +153,10 @@ class GeminiVectorService:
             logger.warning("Vector service not initialized, skipping conversation storage")
             return
         
+        if not user_message.strip() and not ai_response.strip():
+            logger.debug(f"Skipping empty conversation turn for {conversation_id}")
+            return
+        
         try:
             # Create conversation entry
             conversation_entry = {
@@ -84,12 +164,12 @@ class GeminiVectorService:
                 "user_message": user_message,
                 "ai_response": ai_response,
                 "timestamp": datetime.now().isoformat(),
+                "ts_ns": time.time_ns(),
                 "metadata": metadata or {}
             }
             
-            # Generate embeddings for both user message and AI response
-            user_embedding = await self._generate_embedding(user_message)
-            response_embedding = await self._generate_embedding(ai_response)
+            # Generate embeddings for both user message and AI response in one request
+            user_embedding, response_embedding = await self._generate_embeddings_batch([user_message, ai_response])
             
             # Store in conversation store
             if conversation_id not in self.conversation_store:
@@ -102,7 +182,7 @@ class GeminiVectorService:
             })
             
             # Update retriever corpus with new content
-            await self._update_retriever_corpus()
+            await self._update_retriever_corpus([text for text in (user_message, ai_response) if text.strip()])
             
             logger.debug(f"Stored conversation for {conversation_id}")
             
@@ -197,6 +277,7 @@ class GeminiVectorService:
         try:
             # Generate embedding for document content
             embedding = await self._generate_embedding(content)
+            replaced = document_id in self.document_store
             
             # Store document
             self.document_store[document_id] = {
@@ -204,17 +285,68 @@ class GeminiVectorService:
                 "content": content,
                 "embedding": embedding,
                 "metadata": metadata or {},
-                "timestamp": datetime.now().isoformat()
+                "timestamp": datetime.now().isoformat(),
+                "ts_ns": time.time_ns()
             }
+            self._index_document(document_id, embedding)
             
-            # Update retriever corpus
-            await self._update_retriever_corpus()
+            # Update retriever corpus; replacing a document leaves stale text behind, so rebuild
+            await self._update_retriever_corpus(None if replaced else [content])
             
             logger.debug(f"Stored document {document_id}")
             
         except Exception as e:
             logger.error(f"Error storing document: {e}")
     
+    async def store_documents_bulk(self, documents: List[Dict[str, Any]]):
+        """
+        Store many documents, embedding them in batched requests
+        
+        Args:
+            documents: Dicts with ``document_id``, ``content`` and optional ``metadata``
+        """
+        
+        if not self.is_initialized:
+            logger.warning("Vector service not initialized, skipping document storage")
+            return
+        
+        try:
+            semaphore = asyncio.Semaphore(_EMBED_BATCH_CONCURRENCY)
+            
+            async def embed_batch(batch: List[Dict[str, Any]]) -> List[np.ndarray]:
+                async with semaphore:
+                    return await self._generate_embeddings_batch([doc["content"] for doc in batch])
+            
+            batches = [documents[i:i + _EMBED_BATCH_SIZE] for i in range(0, len(documents), _EMBED_BATCH_SIZE)]
+            batch_embeddings = await asyncio.gather(*(embed_batch(batch) for batch in batches))
+            
+            document_ids = [doc["document_id"] for doc in documents]
+            replaced = len(set(document_ids)) != len(document_ids) or any(
+                document_id in self.document_store for document_id in document_ids
+            )
+            
+            timestamp = datetime.now().isoformat()
+            ts_ns = time.time_ns()
+            for batch, embeddings in zip(batches, batch_embeddings):
+                for doc, embedding in zip(batch, embeddings):
+                    self.document_store[doc["document_id"]] = {
+                        "document_id": doc["document_id"],
+                        "content": doc["content"],
+                        "embedding": embedding,
+                        "metadata": doc.get("metadata") or {},
+                        "timestamp": timestamp,
+                        "ts_ns": ts_ns
+                    }
+                    self._index_document(doc["document_id"], embedding)
+            
+            # Update retriever corpus once for the whole ingest
+            await self._update_retriever_corpus(None if replaced else [doc["content"] for doc in documents])
+            
+            logger.debug(f"Stored {len(documents)} documents in {len(batches)} batches")
+            
+        except Exception as e:
+            logger.error(f"Error storing documents: {e}")
+    
     async def search_documents(self, query: str, document_id: str = None, 
                              k: int = 5) -> List[Dict[str, Any]]:
         """Search documents with semantic similarity"""
@@ -226,33 +358,87 @@ class GeminiVectorService:
             # Generate query embedding
             query_embedding = await self._generate_embedding(query)
             
+            # Document rows are normalized at insert, so normalizing the query makes cosine a plain dot product
+            query_vector = np.asarray(query_embedding, dtype=np.float32)
+            query_norm = np.sqrt(_norm_sq(query_vector))
+            if query_norm == 0:
+                return []  # Blank query, which scores zero against every document
+            query_vector = query_vector / query_norm
+            
+            matrix = self._document_matrix(query_vector.shape[0])
+            if matrix is None:
+                return []
+            
             # Search in specific document or all documents
-            search_docs = [self.document_store[document_id]] if document_id and document_id in self.document_store else list(self.document_store.values())
+            if document_id and document_id in self.document_store:
+                row = self._doc_rows.get(document_id)
+                if row is None:
+                    return []
+                doc_ids = [document_id]
+                similarities = matrix[row:row + 1] @ query_vector
+            else:
+                doc_ids = self._doc_ids
+                similarities = matrix @ query_vector
             
-            # Calculate similarities
             results = []
-            for doc in search_docs:
-                if "embedding" in doc:
-                    similarity = cosine_similarity(
-                        [query_embedding], 
-                        [doc["embedding"]]
-                    )[0][0]
-                    
-                    results.append({
-                        "document_id": doc["document_id"],
-                        "content": doc["content"],
-                        "similarity": float(similarity),
-                        "metadata": doc.get("metadata", {})
-                    })
-            
-            # Sort by similarity and return top k
-            results.sort(key=lambda x: x["similarity"], reverse=True)
-            return results[:k]
+            for index in _top_k(similarities, k):
+                doc = self.document_store[doc_ids[index]]
+                results.append({
+                    "document_id": doc["document_id"],
+                    "content": doc["content"],
+                    "similarity": float(similarities[index]),
+                    "metadata": doc.get("metadata", {})
+                })
+            return results
             
         except Exception as e:
             logger.error(f"Error searching documents: {e}")
             return []
     
+    def _document_matrix(self, dimensions: int) -> Optional[np.ndarray]:
+        """Normalized embeddings of every stored document with the given dimensionality"""
+        if self._doc_dirty or self._doc_dim != dimensions:
+            self._doc_matrix = None
+            self._doc_ids = []
+            self._doc_rows = {}
+            self._doc_count = 0
+            self._doc_dim = dimensions
+            self._doc_dirty = False
+            for doc_id, doc in self.document_store.items():
+                embedding = doc.get("embedding")
+                if embedding is not None and len(embedding) == dimensions:
+                    self._index_document(doc_id, embedding)
+        if not self._doc_count:
+            return None
+        return self._doc_matrix[:self._doc_count]
+    
+    def _index_document(self, document_id: str, embedding: np.ndarray):
+        """Write a document's normalized embedding into its matrix row, appending a row for new documents"""
+        if self._doc_dirty:
+            return
+        vector = np.asarray(embedding, dtype=np.float32)
+        if self._doc_dim is None:
+            self._doc_dim = vector.shape[0]
+        elif self._doc_dim != vector.shape[0]:
+            self._doc_dirty = True
+            return
+        
+        row = self._doc_rows.get(document_id)
+        if row is None:
+            capacity = 0 if self._doc_matrix is None else self._doc_matrix.shape[0]
+            if self._doc_count == capacity:
+                grown = np.empty((max(16, 2 * capacity), vector.shape[0]), dtype=np.float32)
+                if self._doc_count:
+                    grown[:self._doc_count] = self._doc_matrix[:self._doc_count]
+                self._doc_matrix = grown
+            row = self._doc_count
+            self._doc_count += 1
+            self._doc_ids.append(document_id)
+            self._doc_rows[document_id] = row
+        
+        norm = np.sqrt(_norm_sq(vector))
+        self._doc_matrix[row] = vector / norm if norm > 0 else vector
+    
     async def get_stats(self) -> Dict[str, Any]:
         """Get vector service statistics"""
         
@@ -272,26 +458,24 @@ class GeminiVectorService:
         """Cleanup old conversations and documents"""
         
         try:
-            cutoff_date = datetime.now() - timedelta(days=days_old)
+            cutoff_ns = time.time_ns() - days_old * 86400 * 10**9
             
             # Cleanup old conversations
             for conv_id in list(self.conversation_store.keys()):
                 conversations = self.conversation_store[conv_id]
-                # Keep conversations newer than cutoff
-                self.conversation_store[conv_id] = [
-                    conv for conv in conversations
-                    if datetime.fromisoformat(conv["timestamp"]) > cutoff_date
-                ]
+                # Keep conversations newer than cutoff; threads are appended in time order
+                del conversations[:bisect_right([conv["ts_ns"] for conv in conversations], cutoff_ns)]
                 
                 # Remove empty conversation threads
-                if not self.conversation_store[conv_id]:
+                if not conversations:
                     del self.conversation_store[conv_id]
             
             # Cleanup old documents
             for doc_id in list(self.document_store.keys()):
                 doc = self.document_store[doc_id]
-                if datetime.fromisoformat(doc["timestamp"]) <= cutoff_date:
+                if doc["ts_ns"] <= cutoff_ns:
                     del self.document_store[doc_id]
+                    self._doc_dirty = True
             
             # Update retriever corpus after cleanup
             await self._update_retriever_corpus()
@@ -301,48 +485,120 @@ class GeminiVectorService:
         except Exception as e:
             logger.error(f"Error during cleanup: {e}")
     
-    async def _generate_embedding(self, text: str) -> List[float]:
+    async def _generate_embedding(self, text: str) -> np.ndarray:
         """Generate embedding using Google's gemini-embedding-001 model"""
 
+        if _is_blank(text):
+            return _blank_embedding(self._embedding_dimensions)
+
+        key = _embedding_key(text)
+        cached = self._cached_embedding(key)
+        if cached is not None:
+            return cached
+
         try:
-            # Use Google's latest embedding model directly
-            result = self.genai_client.embed_content(
-                model="models/gemini-embedding-001",
+            # Use Google's latest embedding model directly; the SDK call is blocking, so keep it off the event loop
+            result = await asyncio.to_thread(
+                self.genai_client.embed_content,
+                model=_EMBEDDING_MODEL,
                 content=text,
-                task_type="retrieval_document"
+                task_type="retrieval_document",
+                client=self._embed_client
             )
 
-            return result['embedding']
+            embedding = np.asarray(result['embedding'], dtype=_EMBEDDING_DTYPE)
+            self._cache_embedding(key, embedding)
+            return embedding
 
         except Exception as e:
             logger.error(f"Error generating Google embedding: {e}")
             # Return simple hash-based embedding as fallback
-            return [float(hash(text[i:i+10]) % 1000) / 1000 for i in range(0, min(len(text), 768), 10)]
+            return _hash_embedding(text)
     
-    async def _update_retriever_corpus(self):
-        """Update the retriever corpus with current data"""
+    async def _generate_embeddings_batch(self, texts: List[str]) -> List[np.ndarray]:
+        """Generate embeddings for several texts in one request, only sending texts not already cached"""
+        
+        keys = [_embedding_key(text) for text in texts]
+        embeddings = [
+            _blank_embedding(self._embedding_dimensions) if _is_blank(text) else self._cached_embedding(key)
+            for text, key in zip(texts, keys)
+        ]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if not missing:
+            return embeddings
         
         try:
-            # Collect all text content for corpus
-            corpus = []
-            
-            # Add conversation content
-            for conversations in self.conversation_store.values():
-                for conv in conversations:
-                    corpus.append(conv["user_message"])
-                    corpus.append(conv["ai_response"])
-            
-            # Add document content
-            for doc in self.document_store.values():
-                corpus.append(doc["content"])
-            
-            # Update retriever if it supports corpus updates
-            if hasattr(self.retriever, 'update_corpus'):
-                self.retriever.update_corpus(corpus)
+            result = await asyncio.to_thread(
+                self.genai_client.embed_content,
+                model=_EMBEDDING_MODEL,
+                content=[texts[i] for i in missing],
+                task_type="retrieval_document",
+                client=self._embed_client
+            )
+            
+            for i, values in zip(missing, result['embedding']):
+                embedding = np.asarray(values, dtype=_EMBEDDING_DTYPE)
+                embeddings[i] = embedding
+                self._cache_embedding(keys[i], embedding)
+        
+        except Exception as e:
+            logger.error(f"Error generating Google embeddings for batch of {len(missing)}: {e}")
+            for i in missing:
+                embeddings[i] = _hash_embedding(texts[i])
+        
+        return embeddings
+    
+    def _cached_embedding(self, key: bytes) -> Optional[np.ndarray]:
+        """Previously generated embedding for a content key, if still cached"""
+        embedding = self._embedding_cache.get(key)
+        if embedding is not None:
+            self._embedding_cache.move_to_end(key)
+        return embedding
+    
+    def _cache_embedding(self, key: bytes, embedding: np.ndarray):
+        """Remember an API-generated embedding, evicting the least recently used"""
+        self._embedding_dimensions = len(embedding)
+        self._embedding_cache[key] = embedding
+        self._embedding_cache.move_to_end(key)
+        if len(self._embedding_cache) > _EMBEDDING_CACHE_SIZE:
+            self._embedding_cache.popitem(last=False)
+    
+    async def _update_retriever_corpus(self, new_items: Optional[List[str]] = None):
+        """
+        Update the retriever corpus with current data
+        
+        Args:
+            new_items: Texts just stored, appended to the corpus; None rebuilds it from the stores
+        """
+        
+        try:
+            if new_items is None:
+                # Collect all text content for corpus
+                corpus = []
+                
+                # Add conversation content
+                for conversations in self.conversation_store.values():
+                    for conv in conversations:
+                        corpus.append(conv["user_message"])
+                        corpus.append(conv["ai_response"])
+                
+                # Add document content
+                for doc in self.document_store.values():
+                    corpus.append(doc["content"])
+                
+                self._corpus = corpus
+            else:
+                self._corpus.extend(new_items)
+            
+            # Update retriever, incrementally when it supports that
+            if new_items is not None and hasattr(self.retriever, 'add'):
+                self.retriever.add(new_items)
+            elif hasattr(self.retriever, 'update_corpus'):
+                self.retriever.update_corpus(self._corpus)
             elif hasattr(self.retriever, 'corpus'):
-                self.retriever.corpus = corpus
+                self.retriever.corpus = self._corpus
             
-            logger.debug(f"Updated retriever corpus with {len(corpus)} items")
+            logger.debug(f"Updated retriever corpus with {len(self._corpus)} items")
             
         except Exception as e:
             logger.error(f"Error updating retriever corpus: {e}")
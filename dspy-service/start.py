@@ -31,7 +31,8 @@ def setup_logging():
         sys.stdout,
         level=log_level,
         format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
-        colorize=True
+        colorize=True,
+        enqueue=True  # Write from a background thread so request threads never block on the sink
     )
     
     # Add file logger
@@ -43,7 +44,8 @@ def setup_logging():
         level=log_level,
         format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}",
         rotation="10 MB",
-        retention="7 days"
+        retention="7 days",
+        enqueue=True
     )
 
 def check_requirements():
@@ -54,7 +56,8 @@ def check_requirements():
         ('uvicorn', 'uvicorn'),
         ('google.generativeai', 'google.generativeai'),
         ('numpy', 'numpy'),
-        ('scikit-learn', 'sklearn')  # scikit-learn imports as sklearn
+        ('orjson', 'orjson'),
+        ('cloudpickle', 'cloudpickle')
     ]
 
     missing_packages = []
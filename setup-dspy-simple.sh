@@ -83,7 +83,7 @@ pip install --upgrade pip
 
 # Install packages one by one to avoid conflicts
 print_info "Installing DSPy..."
-pip install dspy-ai>=2.4.0
+pip install dspy-ai>=2.6.18
 
 print_info "Installing Google Generative AI..."
 pip install google-generativeai>=0.8.0
@@ -92,10 +92,10 @@ print_info "Installing FastAPI and web framework..."
 pip install fastapi>=0.104.0 uvicorn>=0.24.0 pydantic>=2.0.0
 
 print_info "Installing utilities..."
-pip install python-dotenv>=1.0.0 requests>=2.31.0 loguru>=0.7.0
+pip install python-dotenv>=1.0.0 requests>=2.31.0 loguru>=0.7.0 orjson>=3.9.0 cloudpickle>=3.0.0
 
 print_info "Installing basic data processing..."
-pip install numpy>=1.24.0 scikit-learn>=1.3.0
+pip install numpy>=1.24.0
 
 print_status "Essential Python dependencies installed"
 